@@ -20,6 +20,8 @@ from .fly import *
 from .lakeshore import *
 from .motors import *
 from .preamps import *
+from .exposed_spots import *
+from .sample_schedule import *
 from .sample_stage import *
 from .scaler import *
 from .shutters import *
@@ -0,0 +1,266 @@
+
+"""
+live progress & throughput of an area detector acquisition
+"""
+
+__all__ = """
+    AcquisitionProgress
+    LambdaProgress
+    ProgressDeviceStatus
+    RigakuProgress
+""".split()
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+from ophyd import Component, Device, DeviceStatus, Signal
+import threading
+import time
+
+
+class ProgressDeviceStatus(DeviceStatus):
+    """
+    DeviceStatus that reports progress to watchers (such as the progress bar)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._watchers = []
+
+    def watch(self, func):
+        """``func(**kwargs)`` is called with each progress report"""
+        self._watchers.append(func)
+
+    def report(self, **kwargs):
+        """send a progress report to the watchers"""
+        if self.done:
+            return
+        for func in list(self._watchers):
+            try:
+                func(name=self.device.name, **kwargs)
+            except Exception as exc:
+                logger.debug("progress watcher failed: %s", exc)
+
+
+class AcquisitionProgress(Device):
+    """
+    frame rates, ETA, and dropped frames while an acquisition runs
+
+    Published every ``update_s`` (also when no frames arrive, so a
+    stall shows as a rate of zero).  Use ``monitored_signals`` with
+    ``monitor_during`` to record them as secondary streams.
+
+    Subclasses implement ``_attach()``, ``_detach()``, and
+    ``_counts()`` (frames & bad frames so far).
+
+    USAGE (in the parent's ``trigger()``)::
+
+        status = ProgressDeviceStatus(self)
+        self.progress.start(status, total=num_frames)
+        ...
+        self.progress.stop()    # when acquisition is complete
+    """
+
+    frames = Component(Signal, value=0, kind="omitted")
+    frame_rate = Component(Signal, value=0, kind="omitted")         # frames/s, recent
+    average_rate = Component(Signal, value=0, kind="omitted")       # frames/s, since start
+    eta = Component(Signal, value=0, kind="omitted")                # s
+    dropped_rate = Component(Signal, value=0, kind="omitted")       # bad frames/s
+
+    update_s = 0.5      # publication interval
+    stall_s = 5         # warn if no new frames for this long
+    unit = "frames"
+
+    _initial = 0
+    _status = None
+    _ticker = None
+    _total = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    @property
+    def monitored_signals(self):
+        return [
+            self.frames,
+            self.frame_rate,
+            self.average_rate,
+            self.eta,
+            self.dropped_rate,
+        ]
+
+    @property
+    def active(self):
+        return self._ticker is not None
+
+    def start(self, status=None, total=None, initial=0):
+        """
+        begin reporting (not a plan)
+
+        ``initial`` : frames already counted (such as previous
+        frame blocks in the same file), not part of this progress
+        """
+        self.stop()
+        self._status = status
+        self._total = total
+        self._initial = initial
+        self._t0 = time.time()
+        self._last = (self._t0, 0)
+        self._t_frame = self._t0
+        self._stall_reported = False
+        self._attach()
+        with self._lock:
+            self._ticker = threading.Timer(0, self._tick)
+            self._ticker.daemon = True
+            self._ticker.start()
+
+    def stop(self):
+        """publish the final values and stop reporting (not a plan)"""
+        with self._lock:
+            if self._ticker is None:
+                return
+            self._ticker.cancel()
+            self._ticker = None
+        self._detach()
+        self.publish()
+        self._status = None
+
+    def _tick(self):
+        with self._lock:
+            if self._ticker is None:
+                return
+            self.publish()
+            self._ticker = threading.Timer(self.update_s, self._tick)
+            self._ticker.daemon = True
+            self._ticker.start()
+
+    def _attach(self):
+        """subscribe to the parent's signals"""
+
+    def _detach(self):
+        """unsubscribe from the parent's signals"""
+
+    def _counts(self):
+        """(frames, bad frames) so far"""
+        return 0, 0
+
+    def publish(self):
+        """compute and publish the progress values"""
+        now = time.time()
+        n, bad = self._counts()
+        t_last, n_last = self._last
+        self._last = (now, n)
+        if n != n_last:
+            self._t_frame = now
+            self._stall_reported = False
+
+        elapsed = now - self._t0
+        rate = (n - n_last) / max(now - t_last, 1e-9)
+        average = n / elapsed if elapsed > 0 else 0
+        remaining = None
+        if self._total and average > 0:
+            remaining = max(self._total - n, 0) / average
+
+        self.frames.put(n)
+        self.frame_rate.put(rate)
+        self.average_rate.put(average)
+        self.eta.put(remaining if remaining is not None else -1)
+        self.dropped_rate.put(bad / elapsed if elapsed > 0 else 0)
+
+        if now - self._t_frame > self.stall_s and not self._stall_reported:
+            self._stall_reported = True
+            logger.warning(
+                "%s: no new frames for %.1fs (%d of %s received)",
+                self.parent.name, now - self._t_frame, n, self._total)
+
+        if self._status is not None:
+            self._status.report(
+                current=n,
+                initial=0,
+                target=self._total,
+                unit=self.unit,
+                precision=0,
+                fraction=1 - n / self._total if self._total else None,
+                time_elapsed=elapsed,
+                time_remaining=remaining,
+            )
+
+
+class LambdaProgress(AcquisitionProgress):
+    """
+    progress of a Lambda acquisition
+
+    From monitors of ``immout.num_captured``, ``cam.state``,
+    and ``cam.bad_frame_counter``.
+    """
+
+    _cids = ()
+
+    def _attach(self):
+        parent = self.parent
+        self._values = dict(
+            frames=0,
+            bad0=parent.cam.bad_frame_counter.get(),
+            bad=None,
+            state=None,
+        )
+
+        def watch(key):
+            def cb(value, **kwargs):
+                self._values[key] = value
+            return cb
+
+        self._cids = [
+            (parent.immout.num_captured,
+             parent.immout.num_captured.subscribe(watch("frames"), run=False)),
+            (parent.cam.bad_frame_counter,
+             parent.cam.bad_frame_counter.subscribe(watch("bad"), run=False)),
+            (parent.cam.state,
+             parent.cam.state.subscribe(watch("state"))),
+        ]
+
+    def _detach(self):
+        for signal, cid in self._cids:
+            signal.unsubscribe(cid)
+        self._cids = ()
+
+    def _counts(self):
+        v = self._values
+        bad = 0 if v["bad"] is None else v["bad"] - (v["bad0"] or 0)
+        return max((v["frames"] or 0) - self._initial, 0), max(bad, 0)
+
+    @property
+    def detector_state(self):
+        return self._values.get("state") if self._cids else None
+
+
+class RigakuProgress(AcquisitionProgress):
+    """
+    progress of a Rigaku acquisition
+
+    The Rigaku (LabView) does not report frames as they arrive.
+    Frames are estimated from elapsed time and the acquire period.
+    The parent calls ``finish()`` when ``acquire_complete`` reports
+    the acquisition is done.
+    """
+
+    acquire_period = 0      # s, set by the parent before start()
+
+    def _attach(self):
+        self._complete = False
+
+    def finish(self):
+        """acquisition is complete: publish all frames and stop"""
+        self._complete = True
+        self.stop()
+
+    def _counts(self):
+        if self._complete:
+            return self._total or 0, 0
+        if self.acquire_period <= 0:
+            return 0, 0
+        n = int((time.time() - self._t0) / self.acquire_period)
+        if self._total:
+            n = min(n, self._total)
+        return n, 0
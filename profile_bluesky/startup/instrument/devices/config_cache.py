@@ -0,0 +1,69 @@
+
+"""
+issue configuration puts only when the value would change
+"""
+
+__all__ = ['ConfigCacheMixin',]
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+from bluesky import plan_stubs as bps
+import math
+
+
+class ConfigCacheMixin:
+    """
+    remember the configuration applied, skip puts of unchanged values
+
+    For each signal written with ``mv_if_changed()``, keep the
+    value requested and the readback seen after it was applied.
+    A later request is skipped when either
+
+    * the signal's readback already equals the requested value, or
+    * the same value was applied before and the readback has not
+      changed since (covers enum/string readbacks that do not
+      compare equal to the requested value)
+
+    Use ``clear_config_cache()`` to force all puts next time.
+    """
+
+    _config_applied = None
+    config_puts_skipped = 0
+
+    def _config_matches(self, signal, value):
+        try:
+            readback = signal.get()
+        except Exception:
+            return False
+        if isinstance(readback, (int, float)) and isinstance(value, (int, float)):
+            if math.isclose(readback, value, rel_tol=1e-9, abs_tol=1e-12):
+                return True
+        elif readback == value or str(readback) == str(value):
+            return True
+        applied = (self._config_applied or {}).get(signal.name)
+        return applied is not None and applied == (value, readback)
+
+    def mv_if_changed(self, *args):
+        """
+        plan: like ``bps.mv(signal, value, ...)``, only for values that differ
+
+        All changed signals are set in parallel, with one wait.
+        Returns the list of signals that were set.
+        """
+        if self._config_applied is None:
+            self._config_applied = {}
+        pairs = list(zip(args[0::2], args[1::2]))
+        changes = [(s, v) for s, v in pairs if not self._config_matches(s, v)]
+        self.config_puts_skipped += len(pairs) - len(changes)
+        if len(changes) == 0:
+            yield from bps.null()
+            return []
+        yield from bps.mv(*[item for pair in changes for item in pair])
+        for signal, value in changes:
+            self._config_applied[signal.name] = (value, signal.get())
+        return [signal for signal, _ in changes]
+
+    def clear_config_cache(self):
+        """forget the applied configuration"""
+        self._config_applied = {}
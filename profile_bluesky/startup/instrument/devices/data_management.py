@@ -10,14 +10,18 @@ __all__ = [
     'DM_DeviceMixinBase',
     'DM_DeviceMixinAreaDetector',
     'DM_DeviceMixinScaler',
+    'RegisterSnapshot',
 ]
 
 from instrument.session_logs import logger
 logger.info(__file__)
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from ophyd import Component, Device, EpicsMotor, EpicsSignal
 from spec_support.APS_DM_8IDI import DM_Workflow
 from ..devices import aps
+import time
 
 
 xpcs_qmap_file = "Lambda_qmap.h5"		# dm_workflow.set_xpcs_qmap_file("new_name.h5")
@@ -114,6 +118,77 @@ class DataManagementMetadata(Device):
     zspec = Component(EpicsSignal, "8idi:Reg16")
 
 
+# registers read by DM_Workflow.create_hdf5_file() & the HDF5 file name
+HDF5_WORKFLOW_REGISTERS = """
+    angle attenuation beam_center_x beam_center_y beam_size_H beam_size_V
+    burst_mode_state ccdxspec ccdzspec compression dark_begin dark_end
+    data_begin data_end data_folder data_subfolder datafilename detNum
+    detector_distance exposure_period exposure_time first_usable_burst
+    geometry_num hdf_metadata_version kinetics_state kinetics_top
+    kinetics_window_size last_usable_burst number_of_bursts
+    roi_x1 roi_x2 roi_y1 roi_y2 root_folder sample_pitch sample_roll
+    sample_yaw source_begin_beam_intensity_incident
+    source_begin_beam_intensity_transmitted source_begin_current
+    source_begin_datetime source_begin_energy source_end_current
+    source_end_datetime specfile specscan_dark_number specscan_data_number
+    stage_x stage_z stage_zero_x stage_zero_z temperature_A temperature_A_set
+    temperature_B temperature_B_set translation_table_x translation_table_y
+    translation_table_z translation_x translation_y translation_z
+    user_data_folder xspec zspec
+""".split()
+
+
+class _FrozenRegister:
+    """one value of a RegisterSnapshot"""
+
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def get(self, *args, **kwargs):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class RegisterSnapshot:
+    """
+    frozen copy of the values of the DM metadata registers
+
+    Has the same attribute names as ``dm_pars``, each with
+    a ``get()`` method, so it can be used in place of ``dm_pars``
+    (such as by ``DM_Workflow.create_hdf5_file()``) after the
+    registers have been changed for the next acquisition.
+
+    Only the registers ``names`` (default: those the HDF5 workflow
+    file uses) are read, all at once, each within ``timeout`` (s).
+    A register that could not be read raises its error only when
+    its value is used.
+    """
+
+    def __init__(self, registers, names=None, timeout=1):
+        names = [
+            nm for nm in (names or HDF5_WORKFLOW_REGISTERS)
+            if nm in registers.component_names
+        ]
+        pool = ThreadPoolExecutor(max_workers=max(1, len(names)))
+        futures = {nm: pool.submit(getattr(registers, nm).get) for nm in names}
+        pool.shutdown(wait=False)
+        t_end = time.time() + timeout
+        for nm, future in futures.items():
+            try:
+                value = future.result(timeout=max(0, t_end - time.time()))
+                register = _FrozenRegister(value)
+            except FutureTimeoutError:
+                register = _FrozenRegister(
+                    error=TimeoutError(f"register {nm}: no value within {timeout} s"))
+            except Exception as exc:
+                register = _FrozenRegister(error=exc)
+            if register.error is not None:
+                logger.warning("snapshot of register %s failed: %s", nm, register.error)
+            setattr(self, nm, register)
+
+
 dm_pars = DataManagementMetadata(name="dm_pars")
 dm_workflow = DM_Workflow(
     dm_pars, aps.aps_cycle.get(), xpcs_qmap_file,
@@ -0,0 +1,206 @@
+
+"""
+index of exposed sample spots and their cumulative dose
+"""
+
+__all__ = """
+    exposed_spots
+    ExposedSpotIndex
+""".split()
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+import json
+import math
+import numpy as np
+import os
+import threading
+import time
+
+
+class ExposedSpotIndex:
+    """
+    persistent spatial index of exposed (x, z) spots, by sample
+
+    Each spot: position, cumulative ``dose`` (exposure time x flux x
+    attenuator transmission), number of exposures, last exposure time.
+    Exposures closer than ``merge_radius`` add to the same spot.
+    Spots are kept in a grid hash (cells of ``cell`` size) so lookups
+    cost the same with tens of thousands of spots.
+
+    Records are appended to a local file (one JSON line per exposure)
+    and replayed when the index is loaded.
+
+    PARAMETERS
+
+    path : str
+        name of the store file (directory created as needed)
+    cell : float
+        grid cell size (sample stage units), about the minimum spacing
+    merge_radius : float
+        exposures this close are the same spot (default: cell/4)
+
+    USAGE::
+
+        exposed_spots.sample = "holder3"        # name of the current sample
+        exposed_spots.flux = 2e10               # ph/s, dose units
+        exposed_spots.record(x, z, exposure_s=10, transmission=0.1)
+        exposed_spots.is_fresh(x, z, spacing=0.05)
+    """
+
+    flux = 1    # ph/s at full transmission (dose units), set by the user
+
+    def __init__(self, path, cell=0.05, merge_radius=None):
+        self.path = path
+        self.cell = cell
+        self.merge_radius = merge_radius or cell / 4
+        self.sample = ""
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._clear()
+
+    def _clear(self):
+        self._spots = []        # [x, z, dose, exposures, time, sample]
+        self._grid = {}         # (sample, i, j): [spot index]
+
+    def __len__(self):
+        self._load()
+        return len(self._spots)
+
+    def _cell(self, x, z):
+        return int(math.floor(x / self.cell)), int(math.floor(z / self.cell))
+
+    def _near(self, sample, x, z, radius):
+        """indices of spots of ``sample`` within ``radius`` of (x, z)"""
+        i0, j0 = self._cell(x, z)
+        n = int(math.ceil(radius / self.cell))
+        found = []
+        for i in range(i0 - n, i0 + n + 1):
+            for j in range(j0 - n, j0 + n + 1):
+                for k in self._grid.get((sample, i, j), ()):
+                    spot = self._spots[k]
+                    if math.hypot(spot[0] - x, spot[1] - z) <= radius:
+                        found.append(k)
+        return found
+
+    def _add(self, x, z, dose, t, sample):
+        near = self._near(sample, x, z, self.merge_radius)
+        if near:
+            spot = self._spots[near[0]]
+            spot[2] += dose
+            spot[3] += 1
+            spot[4] = t
+        else:
+            self._spots.append([x, z, dose, 1, t, sample])
+            key = (sample,) + self._cell(x, z)
+            self._grid.setdefault(key, []).append(len(self._spots) - 1)
+
+    def _load(self):
+        """replay the store file (once)"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not os.path.exists(self.path):
+                return
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        r = json.loads(line)
+                    except ValueError:
+                        continue
+                    if r.get("clear"):
+                        self._forget(r.get("sample"))
+                    else:
+                        self._add(r["x"], r["z"], r["dose"], r["time"], r.get("sample", ""))
+            logger.debug("%d exposed spots loaded from %s", len(self._spots), self.path)
+
+    def _append(self, record):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as exc:
+            logger.warning("could not save exposed spot: %s", exc)
+
+    def _forget(self, sample):
+        if sample is None:
+            self._clear()
+            return
+        kept = [s for s in self._spots if s[5] != sample]
+        self._clear()
+        for x, z, dose, n, t, smp in kept:
+            self._spots.append([x, z, dose, n, t, smp])
+            key = (smp,) + self._cell(x, z)
+            self._grid.setdefault(key, []).append(len(self._spots) - 1)
+
+    def record(self, x, z, exposure_s, transmission=1, flux=None, **facts):
+        """
+        add an exposure at (x, z) of the current sample, return its dose
+
+        ``facts`` (such as ``uid``) are kept in the store file.
+        """
+        dose = exposure_s * (self.flux if flux is None else flux) * transmission
+        t = time.time()
+        record = dict(x=float(x), z=float(z), dose=float(dose), time=t, sample=self.sample)
+        record.update(facts)
+        self._load()
+        with self._lock:
+            self._add(record["x"], record["z"], record["dose"], t, self.sample)
+            self._append(record)
+        return dose
+
+    def clear(self, sample=None):
+        """forget the spots of ``sample`` (all samples if ``None``)"""
+        self._load()
+        with self._lock:
+            self._forget(sample)
+            self._append(dict(clear=True, sample=sample, time=time.time()))
+
+    def dose(self, x, z, radius=None):
+        """cumulative dose of the current sample within ``radius`` of (x, z)"""
+        self._load()
+        with self._lock:
+            near = self._near(self.sample, x, z, radius or self.merge_radius)
+            return sum(self._spots[k][2] for k in near)
+
+    def is_fresh(self, x, z, spacing, max_dose=0):
+        """True if no more than ``max_dose`` within ``spacing`` of (x, z)"""
+        return self.dose(x, z, radius=spacing) <= max_dose
+
+    def nearest_fresh(self, candidates, here, spacing, speeds=(1, 1), max_dose=0):
+        """
+        index of the fresh candidate fastest to reach from ``here``
+
+        ``candidates``: array (N, 2) of (x, z).  Travel time is
+        ``max(|dx|/vx, |dz|/vz)``.  ``None`` if no candidate is fresh.
+        """
+        candidates = np.asarray(candidates, dtype=float).reshape(-1, 2)
+        fresh = [
+            k for k, (x, z) in enumerate(candidates)
+            if self.is_fresh(x, z, spacing, max_dose)
+        ]
+        if len(fresh) == 0:
+            return None
+        d = np.abs(candidates[fresh] - np.asarray(here, dtype=float))
+        times = (d / np.asarray(speeds, dtype=float)).max(axis=1)
+        return fresh[int(np.argmin(times))]
+
+    def spots(self, sample=None):
+        """array (N, 4) of x, z, dose, exposures for ``sample`` (default: current)"""
+        self._load()
+        sample = self.sample if sample is None else sample
+        with self._lock:
+            return np.array(
+                [s[:4] for s in self._spots if s[5] == sample]).reshape(-1, 4)
+
+
+exposed_spots = ExposedSpotIndex(
+    os.path.join(
+        os.environ.get("HOME", os.getcwd()),
+        ".config",
+        "Bluesky_exposures",
+        "exposed_spots.jsonl",
+    )
+)
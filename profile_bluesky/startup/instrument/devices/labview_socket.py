@@ -0,0 +1,251 @@
+
+"""
+TCP client for LabView command servers (such as the Rigaku detector)
+
+Commands are newline-terminated text lines on one persistent
+connection, replacing ``echo COMMAND | nc host port`` shell pipelines.
+"""
+
+__all__ = """
+    FakeLabViewServer
+    LabViewClient
+    LabViewCommandSignal
+""".split()
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+from concurrent.futures import ThreadPoolExecutor
+from ophyd import DeviceStatus, Signal
+import select
+import socket
+import socketserver
+import threading
+import time
+
+
+class LabViewClient:
+    """
+    persistent TCP connection to a LabView command server
+
+    Thread-safe.  The connection is opened on first use and
+    re-opened (with exponential backoff) when a command fails.
+
+    PARAMETERS
+
+    host : str
+        server host name
+    port : int
+        server TCP port
+    timeout : float
+        socket timeout (s) for connect, send, and reply (default: 2)
+    retries : int
+        attempts for each command (default: 3)
+    backoff : (float, float)
+        first and maximum wait (s) between attempts (default: (0.05, 2))
+
+    EXAMPLE::
+
+        client = LabViewClient("rigaku1.xray.aps.anl.gov", 10000)
+        client.send("EXPOSURE")
+    """
+
+    terminator = b"\n"
+
+    def __init__(self, host, port, timeout=2, retries=3, backoff=(0.05, 2)):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.retries = max(1, retries)
+        self.backoff = backoff
+        self._sock = None
+        self._buffer = b""
+        self._lock = threading.RLock()
+        self.reconnects = 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.host!r}, {self.port})"
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def connect(self):
+        """open the connection (if not open)"""
+        with self._lock:
+            if self._sock is None:
+                sock = socket.create_connection(
+                    (self.host, self.port), timeout=self.timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self._sock = sock
+                self._buffer = b""
+                logger.debug("connected to %s:%d", self.host, self.port)
+
+    def close(self):
+        """close the connection"""
+        with self._lock:
+            if self._sock is not None:
+                try:
+                    self._sock.close()
+                except OSError:
+                    pass
+                self._sock = None
+
+    def _drop_if_closed(self):
+        """close our end if the server has closed the connection"""
+        if self._sock is None:
+            return
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        if readable:
+            try:
+                data = self._sock.recv(4096, socket.MSG_PEEK)
+            except OSError:
+                data = b""
+            if not data:
+                logger.debug("%s: server closed the connection", self)
+                self.close()
+
+    def _readline(self):
+        while self.terminator not in self._buffer:
+            chunk = self._sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(self.terminator, 1)
+        return line.decode().rstrip("\r")
+
+    def send(self, command, reply=False):
+        """
+        send one command, return the reply line (if ``reply``) or ``None``
+
+        Connecting & sending are retried.  Once the command is sent,
+        it is not sent again: a missing reply raises at once.
+        Raises ``ConnectionError`` when the command fails.
+        """
+        payload = command.rstrip("\n").encode() + self.terminator
+        wait, max_wait = self.backoff
+        last_error = None
+        with self._lock:
+            for attempt in range(self.retries):
+                if attempt > 0:
+                    time.sleep(wait)
+                    wait = min(2 * wait, max_wait)
+                    self.reconnects += 1
+                try:
+                    self._drop_if_closed()
+                    self.connect()
+                    self._sock.sendall(payload)
+                    break
+                except OSError as exc:
+                    last_error = exc
+                    logger.warning(
+                        "%s: command %r failed (attempt %d): %s",
+                        self, command, attempt + 1, exc)
+                    self.close()
+            else:
+                raise ConnectionError(
+                    f"{self}: command {command!r} failed"
+                    f" after {self.retries} attempts: {last_error}")
+            if not reply:
+                return None
+            try:
+                return self._readline()
+            except OSError as exc:
+                self.close()
+                raise ConnectionError(
+                    f"{self}: command {command!r} sent, no reply: {exc}")
+
+
+class LabViewCommandSignal(Signal):
+    """
+    send commands to a LabView server, ``set()`` does not block
+
+    Commands are sent in order from one background thread.
+    The value is the last command sent, ``reply`` the last reply.
+
+    PARAMETERS
+
+    host, port
+        LabView server (see ``LabViewClient``)
+    reply : bool
+        expect one reply line for each command (default: False)
+    """
+
+    def __init__(self, *args, host=None, port=None, reply=False, **kwargs):
+        super().__init__(*args, value="", **kwargs)
+        self.client = LabViewClient(host, port)
+        self.expect_reply = reply
+        self.reply = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def set(self, command):
+        status = DeviceStatus(self)
+
+        def job():
+            try:
+                self.reply = self.client.send(command, reply=self.expect_reply)
+                super(LabViewCommandSignal, self).put(command)
+                status._finished()
+            except Exception as exc:
+                logger.error("%s: %s", self.name, exc)
+                status.set_exception(exc)
+
+        self._executor.submit(job)
+        return status
+
+    def put(self, command, **kwargs):
+        """send the command, wait for it to be sent"""
+        self.set(command).wait(self.client.timeout * (self.client.retries + 1))
+
+
+class FakeLabViewServer:
+    """
+    local stand-in for a LabView command server (for testing)
+
+    Records each command line received.  Replies ``OK <command>``
+    to each command when ``reply=True``.
+
+    USAGE::
+
+        server = FakeLabViewServer()    # port chosen by the OS
+        client = LabViewClient("localhost", server.port)
+        client.send("EXPOSURE")
+        server.commands                 # ['EXPOSURE']
+        server.close()
+    """
+
+    def __init__(self, host="localhost", port=0, reply=False):
+        owner = self
+        self.commands = []
+        self.reply = reply
+        self._connections = set()
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                owner._connections.add(self.request)
+                for line in self.rfile:
+                    command = line.decode().strip()
+                    owner.commands.append(command)
+                    if owner.reply:
+                        self.wfile.write(f"OK {command}\n".encode())
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self._server = Server((host, port), Handler)
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """stop the server and drop all client connections"""
+        self._server.shutdown()
+        self._server.server_close()
+        for sock in list(self._connections):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._connections.clear()
@@ -16,9 +16,12 @@ logger.info(__file__)
 # pip install area_detector_handlers
 from area_detector_handlers.handlers import HandlerBase
 from bluesky import plan_stubs as bps
+from .acquisition_progress import LambdaProgress, ProgressDeviceStatus
+from .config_cache import ConfigCacheMixin
 from .data_management import DM_DeviceMixinAreaDetector, dm_pars
 from ..framework import db
 import itertools
+import logging
 import numpy as np
 from ophyd import Component, Device, Signal
 from ophyd import DeviceStatus
@@ -26,7 +29,9 @@ from ophyd import EpicsSignal, EpicsSignalRO, EpicsSignalWithRBV
 import os
 from .shutters import shutter, shutter_override
 from .soft_glue_fpga import pvDELAY_A, pvDELAY_B, sg_num_frames, soft_glue
+from .subscriptions import unsubscribe_later
 import struct
+import threading
 import time
 import uuid
 
@@ -34,9 +39,12 @@ import uuid
 LAMBDA_750K_IOC_PREFIX = "8LAMBDA1:"
 
 
-class Lambda750kCamLocal(Device):
+class Lambda750kCamLocal(ConfigCacheMixin, Device):
     """
     local interface to the ADLambda 750k cam1 plugin
+
+    Configuration is written with ``mv_if_changed()`` (here and on
+    ``soft_glue``), so repeated identical setups skip most puts.
     """
     # implement just the parts needed by our data acquisition
     acquire = Component(EpicsSignalWithRBV, "Acquire", trigger_value=1, kind='config')
@@ -92,7 +100,7 @@ class Lambda750kCamLocal(Device):
         value: 0-7 for ('Int8', 'UInt8', 'Int16', 'UInt16', 'Int32', 'UInt32', 'Float32', 'Float64')
         """
         # from SPEC macro: ccdset_DataType_ad
-        yield from bps.mv(self.data_type, value)
+        yield from self.mv_if_changed(self.data_type, value)
 
     def setImageMode(self, mode):
         """
@@ -101,7 +109,7 @@ class Lambda750kCamLocal(Device):
         # from SPEC macro: ccdset_ImageMode
         if mode not in (0, 1):
             raise ValueError(f"image mode {mode} not allowed, must be one of 0, 1")
-        yield from bps.mv(self.image_mode, mode)
+        yield from self.mv_if_changed(self.image_mode, mode)
 
     def setOperatingMode(self, mode):
         """
@@ -113,8 +121,8 @@ class Lambda750kCamLocal(Device):
                 f"operating mode {mode} not allowed, must be one of 0, 1"
                 " (0='ContinuousReadWrite', 1='TwentyFourBit')"
             )
-        if self.operating_mode.get() != mode:
-            yield from bps.mv(self.operating_mode, mode)
+        changed = yield from self.mv_if_changed(self.operating_mode, mode)
+        if changed:
             # yield from bps.sleep(5.0)     # TODO: still needed?
             logger.info(f"Lambda Operating Mode switched to: {mode}")
 
@@ -129,7 +137,7 @@ class Lambda750kCamLocal(Device):
         """
         # from SPEC macro: ccdset_time_Lambda
         # set exp time always regardless of any mode
-        yield from bps.mv(self.acquire_time, exposure_time)
+        yield from self.mv_if_changed(self.acquire_time, exposure_time)
         # yield from bps.sleep(0.05)
 
         extra = 1e-3     # 1 ms is typical for period
@@ -137,9 +145,9 @@ class Lambda750kCamLocal(Device):
 
         # set period based on the mode
         if self.getOperatingMode == 0:      # continuous read/write mode
-            yield from bps.mv(self.acquire_period, exposure_time)
+            yield from self.mv_if_changed(self.acquire_period, exposure_time)
         else:
-            yield from bps.mv(
+            yield from self.mv_if_changed(
                 self.acquire_period,
                 max(exposure_period, exposure_time + extra)
                 )
@@ -147,29 +155,29 @@ class Lambda750kCamLocal(Device):
 
         if self.EXT_TRIGGER > 0 and self.getOperatingMode == 0:
             # this should work for single-trigger per sequence as well
-            yield from bps.mv(pvDELAY_B, 1e-4)  # for softglue trigger generation (shorter than the fastest frame time)
+            yield from soft_glue.mv_if_changed(pvDELAY_B, 1e-4)  # for softglue trigger generation (shorter than the fastest frame time)
             # yield from bps.sleep(0.05)
-            yield from bps.mv(pvDELAY_A, exposure_time)  # AcquirePeriod in area detector
+            yield from soft_glue.mv_if_changed(pvDELAY_A, exposure_time)  # AcquirePeriod in area detector
             # yield from bps.sleep(0.05)
 
         elif self.EXT_TRIGGER == 2 and self.getOperatingMode == 1:
-            yield from bps.mv(pvDELAY_B, exposure_time)  # AcquireTime in area detector
+            yield from soft_glue.mv_if_changed(pvDELAY_B, exposure_time)  # AcquireTime in area detector
             # yield from bps.sleep(0.05)
-            yield from bps.mv(pvDELAY_A, max(exposure_period, exposure_time + extra))  # AcquirePeriod in area detector
+            yield from soft_glue.mv_if_changed(pvDELAY_A, max(exposure_period, exposure_time + extra))  # AcquirePeriod in area detector
             # yield from bps.sleep(0.05)
 
         elif self.EXT_TRIGGER == 1 and self.getOperatingMode == 1:
             # important thing to be aware:
             # lambda does not support acquire_period in any way,
             # except with trigger per frame mode
-            yield from bps.mv(pvDELAY_B, exposure_time)  # AcquireTime in area detector
+            yield from soft_glue.mv_if_changed(pvDELAY_B, exposure_time)  # AcquireTime in area detector
             # yield from bps.sleep(0.05)
-            yield from bps.mv(pvDELAY_A, exposure_time + 0.0011)  # AcquirePeriod in area detector
+            yield from soft_glue.mv_if_changed(pvDELAY_A, exposure_time + 0.0011)  # AcquirePeriod in area detector
             # yield from bps.sleep(0.05)
 
         if self.EXT_TRIGGER > 0:
             if (exposure_period - exposure_time) >= 0.45 and exposure_time >= 0.05:
-                yield from bps.mv(
+                yield from soft_glue.mv_if_changed(
                     soft_glue.set_shtr_sig_pulse_tr_mode, '0',
                     soft_glue.send_det_sig_pulse_tr_mode, '0',
                     shutter_override, 0,
@@ -177,7 +185,7 @@ class Lambda750kCamLocal(Device):
                 msg = "REGULAR...opens and closes during exposure"
             else:
                 #prevents user from operating shutter for fast duty cycle
-                yield from bps.mv(
+                yield from soft_glue.mv_if_changed(
                     soft_glue.set_shtr_sig_pulse_tr_mode, '1',
                     soft_glue.send_det_sig_pulse_tr_mode, '1',
                     shutter_override, 1,
@@ -193,7 +201,7 @@ class Lambda750kCamLocal(Device):
         # from SPEC macro: ccdset_TriggerMode_Lambda
         if mode not in (0, 1, 2):
             raise ValueError(f"trigger mode {mode} not allowed, must be one of 0, 1, 2")
-        yield from bps.mv(self.trigger_mode, mode)
+        yield from self.mv_if_changed(self.trigger_mode, mode)
 
     def setup_modes(self, num_triggers):
         """
@@ -229,9 +237,10 @@ class Lambda750kCamLocal(Device):
         if self.getOperatingMode == 0:
             num_triggers += 1
         logger.debug(f"num_triggers = {num_triggers}")
-        yield from bps.mv(sg_num_frames, num_triggers)
-
-        yield from bps.mv(soft_glue.send_ext_pulse_tr_sig_to_trig, '1') # external trigger
+        yield from soft_glue.mv_if_changed(
+            sg_num_frames, num_triggers,
+            soft_glue.send_ext_pulse_tr_sig_to_trig, '1',   # external trigger
+        )
         #####shutter burst/regular mode and the corresponding trigger pulses are selected separately###
 
     def setup_trigger_mode_external(self):
@@ -390,7 +399,6 @@ class IMMHandler(HandlerBase):
         while True:
             try:
                 header = readHeader(self.file)
-                print('header rows and cols', header['rows'], header['cols'])
                 cur = self.file.tell()
                 payload_size = header['dlen'] * (6 if header['compression'] == 6 else 2)
                 self.toc.append((cur, header['dlen']))
@@ -407,7 +415,7 @@ class IMMHandler(HandlerBase):
         self.file.close()
 
     def __call__(self, index):
-        logger.info(f'index: {index}')
+        logger.debug("index: %d", index)
         result = np.zeros((self.frames_per_point, self.rows * self.cols), np.uint32)
         for i in range(self.frames_per_point):
             # looping through plane 'i' of chunk 'index'
@@ -434,6 +442,18 @@ class Lambda750kLocal(DM_DeviceMixinAreaDetector, Device):
     # implement just the parts needed by our data acquisition
     detector_number = 25    # 8-ID-I numbering of this detector
 
+    # trigger() starts the soft glue frame triggers (external trigger modes)
+    arms_frame_triggers = True
+    shutter_settle_s = 0.005            # shutter opening time, before acquire
+    frame_trigger_holdoff_s = 0.1       # minimum wait for frame trigger readiness
+    frame_trigger_timeout_s = 5         # maximum wait for frame trigger readiness
+
+    plugin_arm_timeout_s = 5            # maximum wait for IMM plugins to capture
+
+    # trigger() may be called for several frame blocks into one IMM file
+    supports_multi_point = True
+    _num_points = 1
+
     cam = Component(Lambda750kCamLocal, "cam1:")
     immout = Component(IMMoutLocal, "IMMout:")
     imm0 = Component(IMMnLocal, "IMM0:")
@@ -441,6 +461,7 @@ class Lambda750kLocal(DM_DeviceMixinAreaDetector, Device):
     imm2 = Component(IMMnLocal, "IMM2:")
     stats1 = Component(StatsLocal, "Stats1:")
     image = Component(ExternalFileReference, value="", shape=[])
+    progress = Component(LambdaProgress)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -490,31 +511,109 @@ class Lambda750kLocal(DM_DeviceMixinAreaDetector, Device):
         set all IMM plugins for compression
         """
         # from SPEC macro: ccdset_compr_params_ad_Lambda
-        for plugin in (self.imm0, self.imm1, self.imm2, self.immout):
-            if plugin.file_format.get() not in (1, 'IMM_Cmprs'):
-                yield from bps.mv(
-                    plugin.capture, 'Done',             # ('Done', 'Capture')
-                    plugin.file_format, 'IMM_Cmprs',    # ('IMM_Raw', 'IMM_Cmprs')
-                )
+        yield from self._setIMM_format('IMM_Cmprs', (1, 'IMM_Cmprs'))
 
     def setIMM_Raw(self):
         """
         set all IMM plugins for raw (uncompressed)
         """
         # from SPEC macro: ccdset_RawMode_params_ad_Lambda
-        for plugin in (self.imm0, self.imm1, self.imm2, self.immout):
-            if plugin.file_format.get() not in (0, 'IMM_Raw'):
-                yield from bps.mv(
-                    plugin.capture, 'Done',             # ('Done', 'Capture')
-                    plugin.file_format, 'IMM_Raw',      # ('IMM_Raw', 'IMM_Cmprs')
-                )
+        yield from self._setIMM_format('IMM_Raw', (0, 'IMM_Raw'))
+
+    def _setIMM_format(self, file_format, matches):
+        """
+        set the file format of the IMM plugins that need it
+
+        Concurrently: first stop capture on all of them
+        (one group), then write all the formats (one group).
+        """
+        plugins = [
+            plugin
+            for plugin in self.imm_plugins
+            if plugin.file_format.get() not in matches
+        ]
+        if len(plugins) == 0:
+            yield from bps.null()
+            return
+        # ('Done', 'Capture')
+        yield from bps.mv(*[a for p in plugins for a in (p.capture, 'Done')])
+        # ('IMM_Raw', 'IMM_Cmprs')
+        yield from bps.mv(*[a for p in plugins for a in (p.file_format, file_format)])
+
+    @property
+    def imm_plugins(self):
+        """the IMM plugin chain, in order"""
+        return (self.imm0, self.imm1, self.imm2, self.immout)
+
+    def _when_capturing(self, plugins, action, status):
+        """
+        call ``action()`` once all ``plugins`` report capture (readback)
+
+        Readbacks come from monitors.  If not all are capturing
+        within ``plugin_arm_timeout_s``, close the shutter and
+        fail ``status``.
+        """
+        lock = threading.Lock()
+        pending = {p.name for p in plugins}
+        cids = []
+        state = dict(done=False)
+
+        def finish(ok):
+            with lock:
+                if state["done"]:
+                    return False
+                state["done"] = True
+                subscriptions = list(cids)
+            timer.cancel()
+            unsubscribe_later(subscriptions)
+            if ok:
+                try:
+                    action()
+                except Exception as exc:
+                    shutter.close()
+                    status.set_exception(exc)
+            else:
+                shutter.close()
+                emsg = f"IMM plugins not capturing: {sorted(pending)}"
+                logger.error(emsg)
+                status.set_exception(TimeoutError(emsg))
+
+        def capturing(plugin, value):
+            if value in (1, "Capture"):
+                with lock:
+                    pending.discard(plugin.name)
+                    ready = len(pending) == 0
+                if ready:
+                    finish(True)
+
+        def watcher(plugin):
+            def cb(value, **kwargs):
+                capturing(plugin, value)
+            return cb
+
+        timer = threading.Timer(self.plugin_arm_timeout_s, finish, args=(False,))
+        timer.start()
+        for plugin in plugins:
+            cid = plugin.capture.subscribe(watcher(plugin), run=False)
+            with lock:
+                cids.append((plugin.capture, cid))
+                late = state["done"]    # finish() has already unsubscribed
+            if late:
+                unsubscribe_later([(plugin.capture, cid)])
+        for plugin in plugins:
+            capturing(plugin, plugin.capture.get())
 
     def staging_setup_DM(self, *args, **kwargs):
         """
         setup the detector's stage_sigs for acquisition with the DM workflow
+
+        With keyword ``num_points`` (default: 1), the IMM file captures
+        ``num_points`` blocks of ``num_images`` frames, one block per
+        ``trigger()``.  Plugins stay armed between blocks.
         """
         if len(args) != 5:
             raise IndexError(f"expected 5 parameters, received {len(args)}: args={args}")
+        self._num_points = max(1, int(kwargs.get("num_points", 1)))
         self._file_path = args[0]
         self._file_name = args[1]
         num_images = args[2]
@@ -532,7 +631,7 @@ class Lambda750kLocal(DM_DeviceMixinAreaDetector, Device):
         self.immout.stage_sigs["parent.cam.array_callbacks"] = 1
         self.immout.stage_sigs["file_path"] = self._file_path
         self.immout.stage_sigs["file_name"] = self._file_name
-        self.immout.stage_sigs["num_capture"] = num_images
+        self.immout.stage_sigs["num_capture"] = num_images * self._num_points
         self.immout.stage_sigs["file_number"] = 1
         self.immout.stage_sigs["file_format"] = "IMM_Cmprs"
         self.immout.stage_sigs["capture"] = 1
@@ -571,15 +670,16 @@ class Lambda750kLocal(DM_DeviceMixinAreaDetector, Device):
         start_value = 1
         done_value = 0
 
-        status = DeviceStatus(self)
+        status = ProgressDeviceStatus(self)
 
         def watch_state(value, old_value, **kwargs):
             """
             close the shutter once self.cam.state != "RECEIVING_IMAGES"
             """
-            logger.debug(f"lambdadet.cam.state={value}")
-            logger.debug(f"old value={old_value}")
-            logger.debug(f"capture={self.immout.capture.get()}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "lambdadet.cam.state=%s  old value=%s  capture=%s",
+                    value, old_value, self.immout.capture.get())
             if (value in (5, "FINISHED", 6, "PROCESSING_IMAGES") and old_value in (4, "RECEIVING_IMAGES")):
                 shutter.close()
                 self.cam.state.clear_sub(watch_state)
@@ -592,36 +692,63 @@ class Lambda750kLocal(DM_DeviceMixinAreaDetector, Device):
             if value == done_value and old_value != value:
                 self.immout.capture.clear_sub(watch_acquire)
                 logger.info("watch_acquire() method ends")
-                logger.info(f"cam.acquire.get()={self.cam.acquire.get()}")
-                logger.info(f"immout.capture.get()={self.immout.capture.get()}")
-                logger.info(f"immout.num_captured.get()={self.immout.num_captured.get()}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "cam.acquire=%s  immout.capture=%s  immout.num_captured=%s",
+                        self.cam.acquire.get(),
+                        self.immout.capture.get(),
+                        self.immout.num_captured.get())
+                self.progress.stop()
+                status._finished()
+                shutter.close()
+                logger.info("status=%s", status)
+
+        def watch_block(value, **kwargs):
+            """
+            multi-point: wait for this block's frames in the IMM file
+            """
+            if value >= (index + 1) * frames_per_point and not status.done:
+                unsubscribe_later([(self.immout.num_captured, watch_block)])
+                logger.info("frame block %d of %d done", index + 1, self._num_points)
+                self.progress.stop()
                 status._finished()
                 shutter.close()
-                logger.info(f"status={status}")
 
+        def start_camera():
+            if self.cam.EXT_TRIGGER > 0:
+                # before acquire: only a new ready starts the triggers
+                self._arm_frame_triggers(status)
+            self.cam.acquire.put(start_value, wait=False)
+            self.progress.start(
+                status,
+                total=frames_per_point,
+                initial=index * frames_per_point if multi_point else 0)
+
+        def start_acquisition():
+            try:
+                # arm all plugins at once, start the camera when all capture
+                for plugin in self.imm_plugins:
+                    # multi-point: plugins stay armed between blocks
+                    if not multi_point or plugin.capture.get() in (0, "Done"):
+                        plugin.capture.put(1, wait=False)
+                self._when_capturing(self.imm_plugins, start_camera, status)
+            except Exception as exc:
+                shutter.close()
+                status.set_exception(exc)
+
+        index = next(self._datum_counter)
+        frames_per_point = self.get_frames_per_point()
+        multi_point = self._num_points > 1
+
+        status.add_callback(lambda st: self.progress.stop())
         shutter.open()
-        time.sleep(0.005)       # wait for the shutter to move out of the way
         self.cam.state.subscribe(watch_state)
-        self.immout.capture.subscribe(watch_acquire)
-        for plugin in (self.imm0, self.imm1, self.imm2):
-            plugin.capture.put(1, wait=False)
-        self.immout.capture.put(1, wait=False)
-        self.cam.acquire.put(start_value, wait=False)
-        if self.cam.EXT_TRIGGER > 0:
-            # t0 = time.time()
-            # while soft_glue.acquire_ext_trig_status.get() != 1:
-            #     # detector reports (to soft glue) when it is ready for frame triggers
-            #     # Lambda manufacturer recommends this is 0.5 sec or so
-            #     time.sleep(0.025)
-            #     t = time.time() - t0
-            #     if t > 5:
-            #         emsg = f"Lambda detector not ready for frame triggers after {t:.3f}s"
-            #         raise TimeoutError(emsg)
-            # t = time.time() - t0
-            # if t > .2e-10:
-            #     logger.debug(f"waited {t:.3f}s for detector to become ready for frame triggers")
-            time.sleep(0.5) # manufacturer's minimum recommendation
-        index = next(self._datum_counter)
+        if multi_point:
+            self.immout.num_captured.subscribe(watch_block, run=False)
+        else:
+            self.immout.capture.subscribe(watch_acquire)
+        # start once the shutter has moved out of the way, without blocking
+        threading.Timer(self.shutter_settle_s, start_acquisition).start()
         datum_id = f'{self._resource_uid}/{index}'
         datum_doc = {'resource': self._resource_uid,
                      'datum_id': datum_id,
@@ -631,6 +758,72 @@ class Lambda750kLocal(DM_DeviceMixinAreaDetector, Device):
 
         return status
 
+    def _arm_frame_triggers(self, status):
+        """
+        start the soft glue frame triggers when the detector is ready
+
+        Call before the camera's acquire is put.  The detector reports
+        (to soft glue) when it is ready for frame triggers.  Only a
+        0 -> 1 change of ``soft_glue.acquire_ext_trig_status`` seen
+        from now on counts, so a ready left at 1 by the last
+        acquisition is not used.  Start no sooner than
+        ``frame_trigger_holdoff_s``.  Fail ``status`` after
+        ``frame_trigger_timeout_s``.
+        """
+        ready = soft_glue.acquire_ext_trig_status
+        lock = threading.Lock()
+        t0 = time.time()
+        state = dict(armed=False, ready=False, held=False, cid=None)
+
+        def claim():
+            """only one of fire() or timeout() acts"""
+            with lock:
+                if state["armed"]:
+                    return False
+                state["armed"] = True
+                cid = state["cid"]
+            holdoff_timer.cancel()
+            timeout_timer.cancel()
+            if cid is not None:
+                unsubscribe_later([(ready, cid)])
+            return True
+
+        def fire():
+            if claim() and not status.done:
+                logger.debug(
+                    "waited %.3fs for detector to become ready for frame triggers",
+                    time.time() - t0)
+                soft_glue.start_trigger_pulses()
+
+        def fire_when(flag):
+            with lock:
+                state[flag] = True
+                go = state["ready"] and state["held"]
+            if go:
+                # not from a CA callback: start_trigger_pulses() puts PVs
+                threading.Thread(target=fire, daemon=True).start()
+
+        def watch_ready(value, old_value=None, **kwargs):
+            if value == 1 and old_value == 0:
+                fire_when("ready")
+
+        def timeout():
+            if claim():
+                shutter.close()
+                emsg = (
+                    "Lambda detector not ready for frame triggers"
+                    f" after {time.time() - t0:.3f}s"
+                )
+                logger.error(emsg)
+                status.set_exception(TimeoutError(emsg))
+
+        holdoff_timer = threading.Timer(
+            self.frame_trigger_holdoff_s, fire_when, args=("held",))
+        timeout_timer = threading.Timer(self.frame_trigger_timeout_s, timeout)
+        state["cid"] = ready.subscribe(watch_ready, run=False)
+        holdoff_timer.start()
+        timeout_timer.start()
+
     def collect_asset_docs(self):
         cache = self._assets_docs_cache.copy()
         yield from cache
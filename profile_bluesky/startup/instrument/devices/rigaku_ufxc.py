@@ -13,74 +13,48 @@ __all__ = ['rigaku',]
 from instrument.session_logs import logger
 logger.info(__file__)
 
-import apstools.utils
 from bluesky import plan_stubs as bps
-from .data_management import DM_DeviceMixinAreaDetector, dm_pars
+from .acquisition_progress import ProgressDeviceStatus, RigakuProgress
+from .data_management import DM_DeviceMixinAreaDetector, dm_pars, dm_workflow
+from .labview_socket import LabViewCommandSignal
 import itertools
-from ophyd import Component, Device, DeviceStatus
+from ophyd import Component, Device
 from ophyd import Signal, EpicsSignal, EpicsSignalRO
 import os
-import psutil
 from .shutters import shutter_control, shutter_override, shutteroff
+from .subscriptions import unsubscribe_later
 
-import subprocess
-import time
+import struct
+import threading
 import uuid
 
 
-def get_process_info(pid):
-    process_info = psutil.Process(pid)
-    logger.info("process_info status: %s", process_info.status())
-    return process_info
+RIGAKU_LABVIEW_HOST = "rigaku1.xray.aps.anl.gov"
+RIGAKU_LABVIEW_PORT = 10000
 
+# sparse .bin format: one uint64 word per pixel event, frame number
+# in the bits above this shift, words in frame order
+RIGAKU_BIN_FRAME_SHIFT = 40
 
-class UnixCommandSignal(Signal):
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        self.unix_command = None
-        self.unix_output = None
-        self.unix_error = None
-        self.process = None
-
-    def set(self, unix_command):
-        status = DeviceStatus(self)
-        self.unix_command = unix_command
-
-        # see: https://github.com/aps-8id-dys/ipython-8idiuser/issues/195
-
-        self.process = subprocess.Popen(
-            unix_command,
-            shell=True,
-            stdin = subprocess.PIPE,
-            stdout = subprocess.PIPE,
-            stderr = subprocess.PIPE,
-            )
-        pi = get_process_info(self.process.pid)
-        logger.info(
-            "command: %s - process info: pid=%s, info=%s",
-            unix_command,
-            self.process.pid,
-            pi,
-            )
-
-        @apstools.utils.run_in_thread
-        def watch_process():
-            self.unix_output, self.unix_error = self.process.communicate()
-            self.process = None
-            status._finished()
-
-        watch_process()
-        return status
-
-    def put(self, unix_command):
-        status = self.set(unix_command)
-        while not status.done:
-            time.sleep(0.001)
+def rigaku_bin_frame_count(fname, frame_shift=RIGAKU_BIN_FRAME_SHIFT):
+    """
+    number of frames in a Rigaku sparse .bin file
 
-    def get(self):
-        return self.unix_output.decode(), self.unix_error.decode()
+    Only reads the last 8 bytes: the frame number of the
+    last pixel event, plus one.  Returns ``None`` if the file
+    does not exist, is empty, or is not a whole number of words.
+    """
+    try:
+        size = os.path.getsize(fname)
+        if size == 0 or size % 8 != 0:
+            return None
+        with open(fname, "rb") as f:
+            f.seek(-8, os.SEEK_END)
+            word = struct.unpack("<Q", f.read(8))[0]
+    except OSError:
+        return None
+    return (word >> frame_shift) + 1
 
 
 class ShutterModeSignal(EpicsSignal):
@@ -112,8 +86,9 @@ class RigakuFakeCam(Device):
     """
 
     EXT_TRIGGER = 0
-    array_size_x = Component(Signal, value=1024.0)   # FIXME:  1024x512 ?or? 512x1024
-    array_size_y = Component(Signal, value=512.0)
+    # set from the detector definition in staging_setup_DM()
+    array_size_x = Component(Signal, value=512)
+    array_size_y = Component(Signal, value=1024)
 
     def setup_modes(self, num_triggers):
         """
@@ -158,23 +133,42 @@ class Rigaku_8IDI(DM_DeviceMixinAreaDetector, Device):
         "8idi:softGlueC:AND-4_IN2_Signal",
         name="shutter_mode")
 
-    unix_process = Component(UnixCommandSignal)
+    # commands to the Rigaku LabView server, one persistent connection
+    labview = Component(
+        LabViewCommandSignal,
+        host=RIGAKU_LABVIEW_HOST,
+        port=RIGAKU_LABVIEW_PORT)
 
     batch_name = Component(Signal, value="A001")
 
     detector_number = 46    # 8-ID-I numbering of this detector
+    discovers_frame_count = True    # images_received is known after acquisition
+
+    ready_timeout_s = 10        # maximum wait for acquire_complete low
+    exposure_holdoff_s = 0      # wait (s) before sending EXPOSURE
+    exposure_timeout_s = None   # maximum wait (s) for acquire_complete
+
+    data_root = os.path.join("/", "home", "8-id-i-stage/")
+    default_frames = 100000     # if the .bin file cannot be inspected
 
     _assets_docs_cache = []
     _datum_counter = None
     _file_name = None
+    _frames_cache = {}
+    _num_images = None
+    _resource_doc = None
+    _resource_file = None
     _resource_uid = None
 
     cam = Component(RigakuFakeCam)
     image = Component(RigakuFakeImage)
+    progress = Component(RigakuProgress)
 
     def stage(self):
         # prepare to write the document stream for Xi-CAM handling
-        root = os.path.join("/", "home", "8-id-i-stage/")
+        # The resource document is sent with the first datum, once
+        # the .bin file is written and its frames can be counted.
+        root = self.data_root
         folder = self._file_name
         fname = (
             f"{folder}"
@@ -188,49 +182,102 @@ class Rigaku_8IDI(DM_DeviceMixinAreaDetector, Device):
                         'spec': 'RIGAKU',      # FIXME: What format for Rigaku?
                         'resource_path': os.path.join(folder, fname),
                         'root': root,
-                        'resource_kwargs': {
-                            'frames_per_point': self.get_frames_per_point(),
-                            },
+                        'resource_kwargs': {},
                         'path_semantics': 'posix',
                         # can't add new stuff, such as: 'full_name': full_name,
                         }
         self._datum_counter = itertools.count()
-        self.image.shape = [
-            self.get_frames_per_point(),
-            self.cam.array_size_y.get(),
-            self.cam.array_size_x.get()]
-        self._assets_docs_cache.append(('resource', resource_doc))
+        self._frames_cache = {}
+        self._resource_doc = resource_doc
+        self._resource_file = os.path.join(root, folder, fname)
 
         self.shutter_mode.data_mode()  # also calls shutteroff()
         # shutter_control.put() is required for data mode
         # For legacy reasons, it is here and not in data_mode().
         shutter_control.put("Open")
-        cmd = f"echo FILE:F:{self.batch_name.get()} | nc rigaku1.xray.aps.anl.gov 10000"
-        self.unix_process.put(cmd)
+        self.labview.put(f"FILE:F:{self.batch_name.get()}")
 
     def trigger(self):
-        # Tell Rigaku to stop acquisition and wait until it's ready
-        # self.acquire_start.put(0)
-        while self.acquire_complete.get() in (1,'High'):
-            time.sleep(0.1)
-
-        # Getting ready to watch acquisition complete
-        status = DeviceStatus(self)
-
-        def watch_acquire(value,old_value,**kwargs):
-            if value == 1 and old_value == 0:
-                # self.acquire_start.put(0)
-                self.acquire_complete.clear_sub(watch_acquire)
-                status._finished()
-
-        # Start acquisition
-        self.acquire_complete.subscribe(watch_acquire)
-        time.sleep(0.1)  # QZ 06/28/20: No reason. Put it there to improve stability
-        # self.acquire_start.put(1)
-        self.unix_process.put(
-            "echo EXPOSURE | nc rigaku1.xray.aps.anl.gov 10000")
-        time.sleep(0.1)     # could be shorter, this works now
-        # self.acquire_start.put(0)  # Stop acquisition
+        """
+        start an exposure, return a status (does not block)
+
+        Driven by monitor callbacks on ``acquire_complete``:
+
+        1. waiting: for ``acquire_complete`` to be low (Rigaku ready),
+           at most ``ready_timeout_s``
+        2. exposing: ``EXPOSURE`` sent (after ``exposure_holdoff_s``),
+           wait for ``acquire_complete`` to rise, at most
+           ``exposure_timeout_s`` (``None``: no limit)
+        3. done
+        """
+        status = ProgressDeviceStatus(self)
+        lock = threading.Lock()
+        state = dict(phase="waiting", timer=None)
+
+        def set_timer(seconds, phase):
+            if state["timer"] is not None:
+                state["timer"].cancel()
+            state["timer"] = None
+            if seconds is not None:
+                state["timer"] = threading.Timer(seconds, timeout, args=(phase, seconds))
+                state["timer"].daemon = True
+                state["timer"].start()
+
+        def end(phase):
+            """leave the state machine, only once"""
+            with lock:
+                if state["phase"] == "done":
+                    return False
+                state["phase"] = "done"
+                set_timer(None, phase)
+            unsubscribe_later([(self.acquire_complete, watch_complete)])
+            return True
+
+        def timeout(phase, seconds):
+            if state["phase"] == phase and end(phase):
+                emsg = f"Rigaku {phase} for more than {seconds}s"
+                logger.error(emsg)
+                status.set_exception(TimeoutError(emsg))
+
+        def send_exposure():
+            if state["phase"] != "exposing":
+                return
+            sent = self.labview.set("EXPOSURE")
+            sent.add_callback(check_sent)
+            self.progress.start(status, total=self._num_images)
+
+        def check_sent(st):
+            if not st.success and end("exposing"):
+                status.set_exception(
+                    RuntimeError("could not send EXPOSURE to the Rigaku"))
+
+        def start_exposure():
+            with lock:
+                if state["phase"] != "waiting":
+                    return
+                state["phase"] = "exposing"
+                set_timer(self.exposure_timeout_s, "exposing")
+            if self.exposure_holdoff_s > 0:
+                threading.Timer(self.exposure_holdoff_s, send_exposure).start()
+            else:
+                send_exposure()
+
+        def watch_complete(value, old_value, **kwargs):
+            high = value in (1, "High")
+            if state["phase"] == "waiting" and not high:
+                start_exposure()
+            elif state["phase"] == "exposing" and high and old_value in (0, "Low"):
+                if end("exposing"):
+                    self.progress.finish()
+                    status._finished()
+
+        status.add_callback(lambda st: self.progress.stop())
+        set_timer(self.ready_timeout_s, "waiting")
+        # runs at once with the current value
+        self.acquire_complete.subscribe(watch_complete)
+        if state["phase"] == "done":
+            # end() ran first (timeout): nothing else will unsubscribe
+            unsubscribe_later([(self.acquire_complete, watch_complete)])
 
         # write the document stream for Xi-CAM handling
         index = next(self._datum_counter)
@@ -244,6 +291,16 @@ class Rigaku_8IDI(DM_DeviceMixinAreaDetector, Device):
         return status
 
     def collect_asset_docs(self):
+        if self._resource_doc is not None and len(self._assets_docs_cache) > 0:
+            # first datum: now the frames are known
+            frames = self.get_frames_per_point()
+            self._resource_doc['resource_kwargs']['frames_per_point'] = frames
+            self.image.shape = [
+                frames,
+                self.cam.array_size_y.get(),
+                self.cam.array_size_x.get()]
+            self._assets_docs_cache.insert(0, ('resource', self._resource_doc))
+            self._resource_doc = None
         cache = self._assets_docs_cache.copy()
         yield from cache
         self._assets_docs_cache.clear()
@@ -260,10 +317,47 @@ class Rigaku_8IDI(DM_DeviceMixinAreaDetector, Device):
         """
         return f"{self.batch_name.get()}.bin"
 
+    @property
+    def bin_file_candidates(self):
+        """where the batch's .bin file may be, first found is used"""
+        folder = self._file_name or ""
+        names = [os.path.join(self.data_root, folder, self.plugin_file_name)]
+        if self._resource_file is not None:
+            names.insert(0, self._resource_file)
+        return names
+
+    def frames_in_file(self):
+        """
+        frames in this batch's .bin file, ``None`` if not found
+
+        Cached per batch (and file size & modification time).
+        """
+        for fname in self.bin_file_candidates:
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            key = (fname, st.st_size, st.st_mtime)
+            if key not in self._frames_cache:
+                self._frames_cache[key] = rigaku_bin_frame_count(fname)
+            if self._frames_cache[key] is not None:
+                return self._frames_cache[key]
+        return None
+
     @property
     def images_received(self):
-        """Rigaku tells us not to change this.  100k images every time."""
-        return 100000
+        """
+        frames in the .bin file
+
+        Rigaku tells us not to change the number of frames
+        (100k images every time), use that if the file
+        cannot be inspected.
+        """
+        frames = self.frames_in_file()
+        if frames is None:
+            logger.debug("%s: frames not found, using %d", self.name, self.default_frames)
+            return self.default_frames
+        return frames
 
     def staging_setup_DM(self, *args, **kwargs):
         """
@@ -275,12 +369,20 @@ class Rigaku_8IDI(DM_DeviceMixinAreaDetector, Device):
             raise IndexError(f"expected 5 parameters, received {len(args)}: args={args}")
         # file_path = args[0]
         self._file_name = args[1]
-        # num_images = args[2]
+        self._num_images = args[2]
         # acquire_time = args[3]
-        # acquire_period = args[4]
+        self.progress.acquire_period = args[4]
 
         self.batch_name.put(self._file_name)
 
+        # image geometry from the detector's definition
+        try:
+            det_pars = dm_workflow.detectors.getDetectorByNumber(self.detector_number)
+            self.cam.array_size_x.put(det_pars["ccdHardwareColSize"])
+            self.cam.array_size_y.put(det_pars["ccdHardwareRowSize"])
+        except (AttributeError, KeyError) as exc:
+            logger.warning("%s: no detector geometry: %s", self.name, exc)
+
 try:
     rigaku = Rigaku_8IDI(name="rigaku", labels=["rigaku",])
 except TimeoutError:
@@ -0,0 +1,225 @@
+
+"""
+ordered lists of sample positions, planned for short motor travel
+"""
+
+__all__ = """
+    SampleSchedule
+""".split()
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+import numpy as np
+
+
+def move_times(a, b, speeds, overheads=(0, 0)):
+    """
+    time (s) to move from position(s) ``a`` to ``b``, axes move together
+
+    Each axis takes ``|distance|/speed`` (plus its ``overhead``,
+    such as acceleration, when it moves); the slower axis sets the time.
+    """
+    d = np.abs(np.asarray(b, dtype=float) - np.asarray(a, dtype=float))
+    t = d / np.asarray(speeds, dtype=float) + np.where(d > 0, overheads, 0)
+    return t.max(axis=-1)
+
+
+def _nearest_neighbor(times, start):
+    """open path through all nodes, from ``start``, always to the nearest"""
+    n = len(times)
+    visited = np.zeros(n, dtype=bool)
+    order = [start]
+    visited[start] = True
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, times[order[-1]])
+        nxt = int(np.argmin(row))
+        order.append(nxt)
+        visited[nxt] = True
+    return order
+
+
+def _two_opt(order, times, max_passes=20):
+    """improve an open path (first node fixed) by reversing segments"""
+    order = np.array(order)
+    n = len(order)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 2):
+            a, b = order[i], order[i + 1]
+            j = np.arange(i + 2, n)
+            c = order[j]
+            d = order[np.minimum(j + 1, n - 1)]
+            after = np.where(j + 1 < n, times[b, d] - times[c, d], 0)
+            gain = times[a, b] - times[a, c] - after
+            k = int(np.argmax(gain))
+            if gain[k] > 1e-12:
+                jj = j[k]
+                order[i + 1:jj + 1] = order[i + 1:jj + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return list(order)
+
+
+class SampleSchedule:
+    """
+    ordered (x, z) sample positions with predicted move times
+
+    Build with ``grid()`` (serpentine or raster order) or ``points()``
+    (any list), optionally excluding positions, and optionally ordered
+    for the shortest total travel time (nearest neighbor, then 2-opt).
+    Schedules of more than ``max_optimize`` positions are not reordered
+    (the time matrix grows as N^2).
+
+    Travel time between positions: ``max(|dx|/vx, |dz|/vz)``
+    (plus acceleration overhead of each axis that moves).
+
+    PARAMETERS
+
+    positions : array (N, 2)
+        (x, z) positions, in order
+    speeds : (float, float)
+        x & z motor speeds (units/s)
+    overheads : (float, float)
+        extra time (s) when x or z moves, such as acceleration
+
+    EXAMPLE::
+
+        schedule = SampleSchedule.grid(
+            np.linspace(0, 2, 21), np.linspace(0, .5, 15),
+            speeds=(1, 0.5),
+            exclude=lambda x, z: (x - 1)**2 + (z - .25)**2 < 0.01)
+        print(len(schedule), schedule.predicted_time())
+    """
+
+    max_optimize = 1000     # most positions to reorder
+
+    def __init__(self, positions, speeds=(1, 1), overheads=(0, 0)):
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.speeds = tuple(speeds)
+        self.overheads = tuple(overheads)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        x, z = self.positions[index]
+        return float(x), float(z)
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}({len(self)} positions,"
+            f" {self.predicted_time():.1f} s of moves)"
+        )
+
+    @classmethod
+    def grid(cls, xdata, zdata, order="serpentine", fast=None, exclude=None, **kwargs):
+        """
+        positions of the x & z grid
+
+        PARAMETERS
+
+        order : str
+            ``serpentine`` (alternate directions of the fast axis),
+            ``raster`` (fast axis always the same direction), or
+            ``shortest`` (ordered for the shortest travel time,
+            serpentine if more than ``max_optimize`` positions)
+        fast : str
+            axis that changes every position, ``x`` or ``z``
+            (default: the one with more points)
+        exclude : callable or array of bool
+            ``exclude(x, z)`` is True for positions to skip, or
+            a mask shaped (len(zdata), len(xdata))
+        """
+        xdata = np.asarray(xdata, dtype=float)
+        zdata = np.asarray(zdata, dtype=float)
+        fast = fast or ("x" if len(xdata) >= len(zdata) else "z")
+        if fast not in ("x", "z"):
+            raise ValueError(f"fast axis must be 'x' or 'z', received {fast!r}")
+        if order not in ("serpentine", "raster", "shortest"):
+            raise ValueError(f"unknown order {order!r}")
+
+        zz, xx = np.meshgrid(zdata, xdata, indexing="ij")   # shape (nz, nx)
+        keep = ~cls._mask(exclude, xx, zz)
+        if fast == "z":
+            xx, zz, keep = xx.T, zz.T, keep.T
+        rows = []
+        for row, (x, z, k) in enumerate(zip(xx, zz, keep)):
+            line = np.column_stack((x[k], z[k]))
+            if order in ("serpentine", "shortest") and row % 2:
+                line = line[::-1]
+            rows.append(line)
+        schedule = cls(np.concatenate(rows) if rows else [], **kwargs)
+        if order == "shortest":
+            schedule = schedule.optimized()
+        return schedule
+
+    @classmethod
+    def points(cls, positions, exclude=None, optimize=False, start=None, **kwargs):
+        """
+        schedule from a list of (x, z) positions
+
+        ``exclude``: callable ``exclude(x, z)`` or one bool per position.
+        With ``optimize``, order for shortest travel from ``start``.
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        keep = ~cls._mask(exclude, positions[:, 0], positions[:, 1])
+        schedule = cls(positions[keep], **kwargs)
+        if optimize:
+            schedule = schedule.optimized(start=start)
+        return schedule
+
+    @staticmethod
+    def _mask(exclude, x, z):
+        if exclude is None:
+            return np.zeros(np.shape(x), dtype=bool)
+        if callable(exclude):
+            return np.asarray(np.vectorize(exclude)(x, z), dtype=bool)
+        mask = np.asarray(exclude, dtype=bool)
+        if mask.shape != np.shape(x):
+            raise ValueError(
+                f"exclusion mask shape {mask.shape} should be {np.shape(x)}")
+        return mask
+
+    def move_times(self, start=None):
+        """time (s) of each move, from ``start`` (if given) through all positions"""
+        p = self.positions
+        if start is not None:
+            p = np.vstack((np.asarray(start, dtype=float).reshape(1, 2), p))
+        if len(p) < 2:
+            return np.zeros(0)
+        return move_times(p[:-1], p[1:], self.speeds, self.overheads)
+
+    def predicted_time(self, start=None):
+        """total time (s) of all moves, from ``start`` (if given)"""
+        return float(self.move_times(start).sum())
+
+    def optimized(self, start=None):
+        """
+        new schedule of the same positions, ordered for short travel
+
+        Nearest neighbor path from ``start`` (default: first position),
+        improved by 2-opt.  The original order is kept if it is faster,
+        or if there are more than ``max_optimize`` positions.
+        """
+        p = self.positions
+        if len(p) < 3:
+            return self
+        if len(p) > self.max_optimize:
+            logger.warning(
+                "%d positions: more than %d, order not optimized",
+                len(p), self.max_optimize)
+            return self
+        nodes = p if start is None else np.vstack((np.reshape(start, (1, 2)), p))
+        times = move_times(nodes[:, None, :], nodes[None, :, :], self.speeds, self.overheads)
+        order = _two_opt(_nearest_neighbor(times, 0), times)
+        if start is not None:
+            order = [i - 1 for i in order[1:]]
+        candidate = self.__class__(p[order], self.speeds, self.overheads)
+        if candidate.predicted_time(start) < self.predicted_time(start):
+            logger.debug(
+                "travel time %.2f s -> %.2f s",
+                self.predicted_time(start), candidate.predicted_time(start))
+            return candidate
+        return self
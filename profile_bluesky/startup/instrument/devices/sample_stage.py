@@ -9,6 +9,8 @@ from instrument.session_logs import logger
 logger.info(__file__)
 
 from instrument.devices.data_management import dm_pars
+from .exposed_spots import exposed_spots
+from .sample_schedule import SampleSchedule, move_times
 from bluesky import plan_stubs as bps
 import numpy as np
 from ophyd import Component, Device, EpicsMotor
@@ -42,6 +44,21 @@ class SampleStage(Device):
         samplestage.xdata = np.linspace(0, 2, 21)    # runs from 0 to 2 with 21 points
         samplestage.zdata = np.linspace(0, .5, 15)   # runs from 0 to 0.5 with 15 points
 
+    movesample() visits the positions in the order of a ``SampleSchedule``,
+    computed from xdata & zdata (serpentine in transmission).
+    For other orders, point lists, or excluded regions, call
+    ``plan_positions()``.
+
+        samplestage.plan_positions(order="shortest", exclude=lambda x, z: x > 1.5)
+        samplestage.plan_positions(points=[(0, 0), (1, .2), (.5, .1)], optimize=True)
+
+    To avoid spots already exposed (see ``exposed_spots``), set
+    ``fresh_spacing``: movesample() then goes to the nearest
+    position of the schedule with no more than ``max_dose``
+    within that distance.
+
+        samplestage.fresh_spacing = 0.05
+
     """
     x = Component(EpicsMotor, '8idi:m54', labels=["motor", "sample"])
     y = Component(EpicsMotor, '8idi:m49', labels=["motor", "sample"])
@@ -55,27 +72,132 @@ class SampleStage(Device):
     nextpos = 0
     xdata = np.linspace(0, 2, 21)    # example: user will change this
     zdata = np.linspace(0, .5, 15)    # example: user will change this
+    schedule = None                   # SampleSchedule used by movesample()
+    _schedule_source = None           # what the schedule was computed from
+    fresh_spacing = None              # if set, skip spots exposed this close
+    max_dose = 0                      # most dose allowed near a fresh spot
+
+    def _motion(self):
+        """(speeds, overheads) of the x & z motors"""
+        speeds, overheads = [], []
+        for motor in (self.x, self.z):
+            try:
+                speeds.append(motor.velocity.get() or 1)
+                overheads.append(motor.acceleration.get() or 0)
+            except Exception:
+                speeds.append(1)
+                overheads.append(0)
+        return tuple(speeds), tuple(overheads)
+
+    def plan_positions(self, xdata=None, zdata=None, points=None,
+                       order="serpentine", exclude=None, optimize=False):
+        """
+        compute the positions for movesample(), report the move time
+
+        PARAMETERS
+
+        xdata, zdata : array
+            grid positions (default: ``self.xdata``, ``self.zdata``)
+        points : [(x, z)]
+            positions to visit instead of a grid
+        order : str
+            grid order: ``serpentine``, ``raster``, or ``shortest``
+        exclude : callable or array of bool
+            ``exclude(x, z)`` is True for positions to skip
+            (or a mask, see ``SampleSchedule``)
+        optimize : bool
+            order ``points`` for the shortest travel time
+
+        Restarts at the first position.  Returns the ``SampleSchedule``.
+        A schedule of ``points`` is kept (changes of ``xdata`` or
+        ``zdata`` do not replace it) until ``plan_positions()`` is
+        called again.
+        """
+        speeds, overheads = self._motion()
+        kw = dict(speeds=speeds, overheads=overheads)
+        if points is not None:
+            start = (self.x.position, self.z.position) if optimize else None
+            schedule = SampleSchedule.points(
+                points, exclude=exclude, optimize=optimize, start=start, **kw)
+        else:
+            if xdata is not None:
+                self.xdata = np.asarray(xdata)
+            if zdata is not None:
+                self.zdata = np.asarray(zdata)
+            schedule = SampleSchedule.grid(
+                self.xdata, self.zdata, order=order, exclude=exclude, **kw)
+        if len(schedule) == 0:
+            raise ValueError("no sample positions left to visit")
+        self.schedule = schedule
+        if points is None:
+            self._schedule_source = self._grid_source()    # any geometry
+        else:
+            self._schedule_source = "points"    # not from the grid
+        self.nextpos = 0
+        logger.info(
+            "%d sample positions, predicted move time %.1f s (%s)",
+            len(schedule), schedule.predicted_time(), order)
+        return schedule
+
+    def _grid_source(self, geometry=None):
+        """what a default schedule depends on: grid & geometry"""
+        return (
+            tuple(np.asarray(self.xdata).ravel()),
+            tuple(np.asarray(self.zdata).ravel()),
+            geometry,
+        )
+
+    def _default_schedule(self):
+        """schedule from xdata & zdata, as the geometry needs"""
+        geometry = dm_pars.geometry_num.get()
+        source = self._grid_source(geometry)
+        # planned by plan_positions() (points, or grid in any geometry)
+        # or for this geometry
+        if self.schedule is not None and self._schedule_source in (
+                "points", source, self._grid_source()):
+            return self.schedule
+        speeds, overheads = self._motion()
+        if geometry == 0: # transmission
+            fast = "x" if len(self.xdata) > len(self.zdata) else "z"
+            schedule = SampleSchedule.grid(
+                self.xdata, self.zdata, order="serpentine", fast=fast,
+                speeds=speeds, overheads=overheads)
+        else:    # reflection: x & z step together
+            xn, zn = len(self.xdata), len(self.zdata)
+            n = np.lcm(xn, zn)
+            schedule = SampleSchedule(
+                [(self.xdata[i % xn], self.zdata[i % zn]) for i in range(n)],
+                speeds=speeds, overheads=overheads)
+        self.schedule = schedule
+        self._schedule_source = source
+        logger.info(
+            "%d sample positions, predicted move time %.1f s",
+            len(schedule), schedule.predicted_time())
+        return schedule
 
     def movesample(self):
         """
-        move the sample x&z to the next position
+        move the sample x&z to the next position of the schedule
         """
-        if dm_pars.geometry_num.get() == 0: # transmission
-            xn = len(self.xdata)
-            zn = len(self.zdata)
-            if xn > zn:
-                x = self.nextpos % xn
-                z = int(self.nextpos/xn) % zn
+        schedule = self._default_schedule()
+        here = (self.x.position, self.z.position)
+        index = self.nextpos % len(schedule)
+        if self.fresh_spacing:
+            fresh = exposed_spots.nearest_fresh(
+                schedule.positions, here, self.fresh_spacing,
+                speeds=schedule.speeds, max_dose=self.max_dose)
+            if fresh is None:
+                logger.warning(
+                    "no fresh sample position (spacing %g), using position %d",
+                    self.fresh_spacing, index)
             else:
-                x = int(self.nextpos/zn) % xn
-                z = self.nextpos % zn
-        else:    # reflection
-            x = self.nextpos % len(self.xdata)
-            z = self.nextpos % len(self.zdata)
-
-        x = self.xdata[x]
-        z = self.zdata[z]
-        logger.info(f"Moving samx to {x}, samz to {z}")
+                index = self.nextpos = fresh
+        x, z = schedule[index]
+        predicted = move_times(
+            here, (x, z), schedule.speeds, schedule.overheads)
+        logger.info(
+            f"Moving samx to {x}, samz to {z}"
+            f" (predicted {predicted:.2f} s)")
         yield from bps.mv(
             self.x, x,
             self.z, z,
@@ -22,6 +22,10 @@ logger.info(__file__)
 from .data_management import DM_DeviceMixinScaler
 from ophyd.scaler import ScalerCH
 from ophyd import Kind
+import re
+
+
+_UNSAFE_CHARACTERS = re.compile("[^a-zA-Z0-9_]")
 
 
 def safeOphydName(text):
@@ -32,20 +36,53 @@ def safeOphydName(text):
     Remove troublesome characters, perhaps other cleanup as well.
     This is best done with regular expression pattern matching.
     """
-    import re
-    pattern = "[a-zA-Z0-9_]"
-
-    def mapper(c):
-        if re.match(pattern, c) is not None:
-            return c
-        return "_"
-
-    return "".join([mapper(c) for c in text])
+    return _UNSAFE_CHARACTERS.sub("_", text)
 
 
+class FixScalerCH(ScalerCH):
+    """
+    ScalerCH with a cached channel name map
 
+    The name -> channel map is built once and rebuilt only after
+    a channel name (``chname`` monitor) changes.  A selection
+    is applied as a difference from the previous one (nothing
+    to do when the same channels are selected again).
+    """
 
-class FixScalerCH(ScalerCH):
+    _name_map = None
+    _selected = None
+    _chname_watched = False
+
+    def channel_name_map(self):
+        """dictionary: EPICS channel name -> channel component name"""
+        if self._name_map is None:
+            if not self._chname_watched:
+                for s in self.channels.component_names:
+                    getattr(self.channels, s).chname.subscribe(
+                        self._chname_changed, run=False)
+                self._chname_watched = True
+            self.match_names()  # name channels by EPICS names
+            name_map = {}
+            for i, s in enumerate(self.channels.component_names):
+                channel = getattr(self.channels, s)
+                # just in case the name is not yet safe
+                channel.s.name = safeOphydName(channel.s.name)
+                nm = channel.s.name  # as defined in scaler.match_names()
+                if i == 0 and len(nm) == 0:
+                    nm = "clock"        # ALWAYS get the clock channel
+                if len(nm) > 0:
+                    name_map[nm] = s
+            self._name_map = name_map
+        return self._name_map
+
+    def _chname_changed(self, *args, **kwargs):
+        """a channel was renamed in EPICS: rebuild the map when needed"""
+        self.clear_channel_cache()
+
+    def clear_channel_cache(self):
+        """forget the name map and selection, rebuild at next selection"""
+        self._name_map = None
+        self._selected = None
 
     def select_channels(self, chan_names=[]):
         '''Select channels based on the EPICS name PV
@@ -58,17 +95,7 @@ class FixScalerCH(ScalerCH):
             of the channels to select.
             If *None*, select all channels named in the EPICS scaler.
         '''
-        self.match_names()  # name channels by EPICS names
-        name_map = {}
-        for i, s in enumerate(self.channels.component_names):
-            channel = getattr(self.channels, s)
-            # just in case the name is not yet safe
-            channel.s.name = safeOphydName(channel.s.name)
-            nm = channel.s.name  # as defined in scaler.match_names()
-            if i == 0 and len(nm) == 0:
-                nm = "clock"        # ALWAYS get the clock channel
-            if len(nm) > 0:
-                name_map[nm] = s
+        name_map = self.channel_name_map()
 
         # previous argument was chan_names=None to select all
         # include logic here that allows backwards-compatibility
@@ -84,16 +111,25 @@ class FixScalerCH(ScalerCH):
                                     "on the scaler.  The named channels are "
                                     "{}".format(ch, tuple(name_map)))
 
+        previous = self._selected
+        if previous is not None and previous == tuple(read_attrs):
+            return      # already selected
+
         self.channels.kind = Kind.normal
         self.channels.read_attrs = list(read_attrs)
         self.channels.configuration_attrs = list(read_attrs)
 
-        for i, s in enumerate(self.channels.component_names):
+        if previous is None:
+            changed = self.channels.component_names
+        else:
+            changed = set(previous).symmetric_difference(read_attrs)
+        for s in changed:
             channel = getattr(self.channels, s)
             if s in read_attrs:
                 channel.s.kind = Kind.hinted
             else:
                 channel.s.kind = Kind.normal
+        self._selected = tuple(read_attrs)
 
 
 class LocalScalerCH(DM_DeviceMixinScaler, FixScalerCH):
@@ -16,10 +16,17 @@ logger.info(__file__)
 
 import apstools.devices
 from bluesky import plan_stubs as bps
+from .config_cache import ConfigCacheMixin
 from ophyd import Component, Device, EpicsSignal
 
 
-class SoftGlueDevice(Device):
+class SoftGlueDevice(ConfigCacheMixin, Device):
+    """
+    soft glue FPGA controls
+
+    Configuration writes (trigger & shutter modes, delays)
+    go through ``mv_if_changed()``, trigger actions do not.
+    """
 
     start_trigger_pulses_sig = Component(EpicsSignal, '8idi:softGlueA:MUX2-1_IN0_Signal')
     reset_trigger_pulses_sig = Component(EpicsSignal, '8idi:softGlueA:OR-1_IN2_Signal')
@@ -50,6 +57,14 @@ class SoftGlueDevice(Device):
         else:
             logger.info("Waiting for ****User Trigger**** to start acquisition")
 
+    def start_trigger_pulses(self):
+        """start trigger pulses now (not a plan, for use in callbacks)"""
+        if self.select_pulse_train_source.get() == '0':
+            logger.info("Starting detector trigger pulses")
+            self.start_trigger_pulses_sig.put("1!")
+        else:
+            logger.info("Waiting for ****User Trigger**** to start acquisition")
+
     def reset_trigger(self):
         # from SPEC macro: Reset_SoftGlue_Trigger
         logger.info("Resetting detector trigger pulses")
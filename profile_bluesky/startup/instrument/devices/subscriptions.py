@@ -0,0 +1,28 @@
+"""
+remove signal subscriptions safely from subscription callbacks
+"""
+
+__all__ = ['unsubscribe_later',]
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+import threading
+
+
+def unsubscribe_later(subscriptions):
+    """
+    unsubscribe ``[(signal, cid)]`` from another thread
+
+    ``cid`` may also be the callback function (uses ``clear_sub()``).
+    Safe to call from a CA (subscription) callback, where
+    unsubscribing directly can deadlock the monitor dispatcher.
+    A callback may still run (once more) before it is removed.
+    """
+    def job():
+        for signal, cid in subscriptions:
+            if callable(cid):
+                signal.clear_sub(cid)
+            else:
+                signal.unsubscribe(cid)
+    threading.Thread(target=job, daemon=True).start()
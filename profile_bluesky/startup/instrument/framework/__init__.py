@@ -2,6 +2,8 @@ from .check_python import *
 from .check_bluesky import *
 
 from .initialize import *
+from .document_spool import *
 from .user_dir import *
 from .metadata import *
 from .callbacks import *
+from .run_context import *
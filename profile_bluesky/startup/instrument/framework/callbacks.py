@@ -4,6 +4,7 @@ custom callbacks
 """
 
 __all__ = [
+    'BufferedSpecWriterCallback',
     'specwriter',
     'spec_comment',
     'newSpecFile',
@@ -14,13 +15,94 @@ logger.info(__file__)
 
 import apstools.filewriters
 import apstools.utils
+import atexit
 import datetime
 import os
+import queue
+import threading
+import time
 
 from .initialize import RE, callback_db
 
+
+class BufferedSpecWriterCallback(apstools.filewriters.SpecWriterCallback):
+    """
+    SPEC file writer that formats and writes in a background thread
+
+    The RunEngine thread only puts each document on a queue.
+    One worker thread handles the documents (in order),
+    and formats & writes the scan (parent class code) at the end
+    of the run.  A slow file system no longer blocks the RunEngine.
+    Scans still queued are written when the session exits.
+
+    Call ``flush()`` to wait until everything queued is written.
+    ``newfile()`` waits for pending scans before changing files.
+    Use ``comment()`` (or ``spec_comment()``) to add comments in order.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._work, name="BufferedSpecWriter", daemon=True
+        )
+        self._worker.start()
+        self.receiving = False      # between start & stop (RunEngine's view)
+        super().__init__(*args, **kwargs)
+        atexit.register(self.flush, timeout=30)
+
+    def _work(self):
+        while True:
+            func, args = self._queue.get()
+            try:
+                func(*args)
+            except Exception as exc:
+                logger.exception("SPEC file writer: %s", exc)
+            finally:
+                self._queue.task_done()
+
+    def receiver(self, key, document):
+        """Bluesky callback: queue all documents for handling"""
+        if key == "start":
+            self.receiving = True
+        elif key == "stop":
+            self.receiving = False
+        self._queue.put((super().receiver, (key, document)))
+
+    def comment(self, text, doc=None):
+        """queue a comment, after the documents already received"""
+        if doc is None:
+            doc = "event" if self.receiving else "start"
+        for line in text.splitlines():
+            self._queue.put((self._cmt, (doc, line)))
+
+    def flush(self, timeout=None):
+        """
+        wait until all queued documents are written
+
+        Returns ``True`` if all were handled before ``timeout`` (s).
+        """
+        if timeout is None:
+            self._queue.join()
+            return True
+        t_end = time.time() + timeout
+        done = self._queue.all_tasks_done      # condition used by queue.join()
+        with done:
+            while self._queue.unfinished_tasks > 0:
+                remaining = t_end - time.time()
+                if remaining <= 0:
+                    return False
+                done.wait(remaining)
+        return True
+
+    def newfile(self, *args, **kwargs):
+        """prepare to use a new SPEC data file, after pending scans are written"""
+        if threading.current_thread() is not self._worker:
+            self.flush()
+        return super().newfile(*args, **kwargs)
+
+
 # write scans to SPEC data file
-specwriter = apstools.filewriters.SpecWriterCallback()
+specwriter = BufferedSpecWriterCallback()
 #_path = "/tmp"      # make the SPEC file in /tmp (assumes OS is Linux)
 _path = os.getcwd() # make the SPEC file in current working directory (assumes is writable)
 specwriter.newfile(os.path.join(_path, specwriter.spec_filename))
@@ -33,8 +115,8 @@ logger.info(f"   to change SPEC file, use command:   newSpecFile('title')")
 
 
 def spec_comment(comment, doc=None):
-    # supply our specwriter to the standard routine
-    apstools.filewriters.spec_comment(comment, doc, specwriter)
+    # comments are queued in order with the documents
+    specwriter.comment(comment, doc)
 
 
 def newSpecFile(title, scan_id=1):
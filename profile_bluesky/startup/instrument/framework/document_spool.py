@@ -0,0 +1,352 @@
+"""
+local, append-only spool of RunEngine documents, with replay
+"""
+
+__all__ = [
+    "DocumentSpool",
+    "replay_spool",
+]
+
+from ..session_logs import logger
+logger.info(__file__)
+
+from .document_writer import write_document_lines
+from pymongo.errors import DuplicateKeyError
+import atexit
+import functools
+import glob
+import itertools
+import json
+import numpy as np
+import os
+import queue
+import threading
+import time
+import types
+
+
+FSYNC_POLICIES = ("never", "stop", "descriptor", "always")
+
+
+def read_document_lines(fname):
+    """generate ``(name, doc)`` pairs from a spool (or spill) file"""
+    with open(fname, "r") as fp:
+        for line in fp:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                name, doc = json.loads(line)
+            except ValueError:
+                # partial last line (session ended while writing)
+                logger.warning("ignoring damaged line in %s", fname)
+                break
+            yield name, doc
+
+
+def _run_stop(run):
+    """stop document of a catalog run (v1 header or v2 run), or None"""
+    stop = getattr(run, "stop", None)
+    if stop is None and hasattr(run, "metadata"):
+        stop = run.metadata.get("stop")
+    return stop
+
+
+def replay_spool(source, catalog, skip_existing=True):
+    """
+    push spooled runs into a databroker catalog
+
+    PARAMETERS
+
+    source : str or [str]
+        spool (or spill) file(s), or a directory of them
+    catalog : object
+        databroker catalog that will receive the documents:
+        a v1 ``Broker`` (``db``), a v2 catalog (uses ``.v1``),
+        or a function ``insert(name, doc)``
+    skip_existing : bool
+        do not replay runs whose ``uid`` is already in the catalog
+        with a ``stop`` document (only checked for catalogs that
+        support ``catalog[uid]``).  A run that was partly inserted
+        (no ``stop``) is replayed, documents already in the catalog
+        (``DuplicateKeyError``) are skipped.  (default: True)
+
+    Returns list of replayed run ``uid``.
+
+    USAGE::
+
+        replay_spool(db_spool.path, db)                         # all runs
+        replay_spool(db_spool.run_file("a1b2c3"), db)           # one run
+        replay_spool(db_writer.spill_files, db)      # skips what is in db
+    """
+    # a Broker (and a v2 catalog) is callable too: check for insert() first
+    is_function = isinstance(
+        catalog, (types.FunctionType, types.MethodType, functools.partial))
+    if hasattr(catalog, "insert"):
+        insert = catalog.insert
+    elif hasattr(catalog, "v1"):
+        insert = catalog.v1.insert
+    elif is_function:
+        insert = catalog
+    else:
+        raise TypeError(f"cannot insert documents into {catalog!r}")
+
+    if isinstance(source, str):
+        if os.path.isdir(source):
+            source = sorted(
+                glob.glob(os.path.join(source, "*.jsonl")), key=os.path.getmtime
+            )
+        else:
+            source = [source]
+
+    replayed = []
+    for fname in source:
+        documents = read_document_lines(fname)
+        first = next(documents, None)
+        if first is None or first[0] != "start":
+            logger.warning("no start document, not replayed: %s", fname)
+            continue
+        uid = first[1]["uid"]
+        partial = False
+        if skip_existing and not is_function:
+            try:
+                run = catalog[uid]
+            except (KeyError, ValueError):
+                run = None
+            if run is not None:
+                if _run_stop(run) is not None:
+                    logger.info("run %s already in catalog, not replayed", uid)
+                    continue
+                logger.info("run %s partly in catalog, replaying the rest", uid)
+                partial = True
+        duplicates = 0
+        for name, doc in itertools.chain([first], documents):
+            try:
+                insert(name, doc)
+            except DuplicateKeyError:
+                if not partial:
+                    raise
+                duplicates += 1     # already inserted before the spill
+        if duplicates > 0:
+            logger.info("run %s: %d documents were already in catalog", uid, duplicates)
+        replayed.append(uid)
+        logger.info("replayed run %s from %s", uid, fname)
+    return replayed
+
+
+class DocumentSpool:
+    """
+    write every RunEngine document to a local, append-only spool
+
+    One JSON-lines file (a *segment*) per run, named by the run's ``uid``::
+
+        <path>/<uid>.jsonl
+
+    Each line is ``[name, doc]`` (same format as the spill files of
+    :class:`~instrument.framework.document_writer.BufferedDocumentWriter`).
+    Use :func:`replay_spool` to push spooled runs into any catalog later.
+
+    The RunEngine thread only puts each document on a queue;
+    a worker thread does all file operations.  File errors
+    (such as a full disk) are logged, they do not stop the scan.
+
+    The spool is also a fast, local cache of recent runs::
+
+        db_spool.recent()                 # list recent runs
+        db_spool.documents(-1)            # all documents of last run
+        db_spool.table(-1)                # primary stream as arrays
+
+    PARAMETERS
+
+    path : str
+        directory for the segments (created as needed)
+    fsync : str
+        when to force the segment to disk, one of:
+        ``never`` (leave it to the OS),
+        ``stop`` (at end of run, default),
+        ``descriptor`` (after each start, descriptor, resource & stop),
+        ``always`` (after every document)
+    max_runs : int
+        keep only this many segments, oldest removed first
+        (default: 1000, ``None`` keeps all)
+    max_queue : int
+        back-pressure limit: the RunEngine thread blocks
+        when this many documents are waiting to be spooled
+        (default: 10000)
+    """
+
+    def __init__(self, path, fsync="stop", max_runs=1000, max_queue=10000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync='{fsync}' must be one of {FSYNC_POLICIES}")
+        self.path = path
+        self.fsync = fsync
+        self.max_runs = max_runs
+        self._fp = None
+        os.makedirs(self.path, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = threading.Thread(
+            target=self._work, name="DocumentSpool", daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.flush, timeout=30)
+
+    def __call__(self, name, doc):
+        """RunEngine callback: queue the document (blocks if queue is full)"""
+        try:
+            self._queue.put_nowait((name, doc))
+        except queue.Full:
+            logger.warning(
+                "document spool queue full (%d), waiting for disk",
+                self._queue.maxsize,
+            )
+            self._queue.put((name, doc))
+
+    def flush(self, timeout=None):
+        """
+        wait until all queued documents are spooled
+
+        Returns ``True`` if all documents were handled before ``timeout`` (s).
+        """
+        if timeout is None:
+            self._queue.join()
+            return True
+        t_end = time.time() + timeout
+        done = self._queue.all_tasks_done      # condition used by queue.join()
+        with done:
+            while self._queue.unfinished_tasks > 0:
+                remaining = t_end - time.time()
+                if remaining <= 0:
+                    return False
+                done.wait(remaining)
+        return True
+
+    def _work(self):
+        while True:
+            name, doc = self._queue.get()
+            try:
+                self._spool(name, doc)
+            except OSError as exc:
+                logger.error("could not spool '%s' document: %s", name, exc)
+            except Exception as exc:
+                logger.exception("document spool failed: %s", exc)
+            finally:
+                self._queue.task_done()
+
+    def _spool(self, name, doc):
+        """append the document to this run's segment (worker thread)"""
+        if name == "start":
+            self._close()
+            self._fp = open(self.run_file(doc["uid"], new=True), "a")
+        if self._fp is None:
+            return      # not in a run
+        write_document_lines(self._fp, [(name, doc)])
+        self._fp.flush()
+        if self.fsync == "always" or (
+            self.fsync == "descriptor"
+            and name in ("start", "descriptor", "resource", "stop")
+        ):
+            os.fsync(self._fp.fileno())
+        if name == "start":
+            self.prune()
+        elif name == "stop":
+            self._close()
+
+    def _close(self):
+        fp, self._fp = self._fp, None
+        if fp is not None:
+            try:
+                if self.fsync != "never":
+                    os.fsync(fp.fileno())
+            finally:
+                fp.close()
+
+    @property
+    def segments(self):
+        """spool segment files, oldest first"""
+        return sorted(
+            glob.glob(os.path.join(self.path, "*.jsonl")), key=os.path.getmtime
+        )
+
+    def run_file(self, key, new=False):
+        """
+        segment file of the run identified by ``key``
+
+        ``key`` is a (partial) ``uid`` or an index (``-1`` is the most recent run)
+        """
+        if new:
+            return os.path.join(self.path, f"{key}.jsonl")
+        segments = self.segments
+        if isinstance(key, int):
+            return segments[key]
+        matches = [
+            f for f in segments
+            if os.path.basename(f).startswith(key)
+        ]
+        if len(matches) != 1:
+            raise KeyError(f"{len(matches)} spooled runs match uid '{key}'")
+        return matches[0]
+
+    def prune(self):
+        """remove oldest segments beyond ``max_runs``"""
+        if self.max_runs is None:
+            return
+        segments = self.segments
+        for fname in segments[: max(0, len(segments) - self.max_runs)]:
+            os.remove(fname)
+
+    def documents(self, key=-1):
+        """list of ``(name, doc)`` of a spooled run"""
+        self.flush(timeout=5)
+        return list(read_document_lines(self.run_file(key)))
+
+    def recent(self, n=20):
+        """list of summary dictionaries of the ``n`` most recent spooled runs"""
+        self.flush(timeout=5)
+        summaries = []
+        for fname in self.segments[-n:]:
+            start, stop = None, None
+            for name, doc in read_document_lines(fname):
+                if name == "start":
+                    start = doc
+                elif name == "stop":
+                    stop = doc
+            if start is None:
+                continue
+            summaries.append(
+                dict(
+                    uid=start["uid"],
+                    scan_id=start.get("scan_id"),
+                    plan_name=start.get("plan_name"),
+                    time=start["time"],
+                    exit_status=(stop or {}).get("exit_status", "incomplete"),
+                    num_events=(stop or {}).get("num_events", {}),
+                )
+            )
+        return summaries
+
+    def table(self, key=-1, stream="primary"):
+        """
+        dictionary of numpy arrays of one stream of a spooled run
+
+        Keys are the data keys of the stream plus ``time``.
+        Externally-stored data (such as area detector images)
+        are represented by their ``datum_id``.
+        """
+        self.flush(timeout=5)
+        descriptors = set()
+        rows = []
+        for name, doc in read_document_lines(self.run_file(key)):
+            if name == "descriptor" and doc.get("name") == stream:
+                descriptors.add(doc["uid"])
+            elif name == "event" and doc["descriptor"] in descriptors:
+                row = dict(doc["data"])
+                row["time"] = doc["time"]
+                rows.append(row)
+            elif name == "event_page" and doc["descriptor"] in descriptors:
+                for i, t in enumerate(doc["time"]):
+                    row = {k: v[i] for k, v in doc["data"].items()}
+                    row["time"] = t
+                    rows.append(row)
+        keys = rows[0].keys() if len(rows) > 0 else []
+        return {k: np.array([row.get(k) for row in rows]) for k in keys}
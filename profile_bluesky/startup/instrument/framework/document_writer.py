@@ -0,0 +1,262 @@
+"""
+buffered, asynchronous writer of RunEngine documents to the databroker
+"""
+
+__all__ = [
+    "BufferedDocumentWriter",
+]
+
+from ..session_logs import logger
+logger.info(__file__)
+
+import atexit
+import event_model
+import json
+import numpy as np
+import os
+import queue
+import threading
+import time
+
+
+def _json_default(obj):
+    """make numpy objects (and others) safe for json.dumps()"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def write_document_lines(fp, documents):
+    """
+    append ``(name, doc)`` pairs to open file ``fp``, one JSON list per line
+
+    Numpy content is converted to lists (or Python scalars).
+    Read with :func:`instrument.framework.document_spool.read_document_lines`.
+    """
+    fp.write(
+        "".join(
+            json.dumps([name, doc], default=_json_default) + "\n"
+            for name, doc in documents
+        )
+    )
+
+
+class BufferedDocumentWriter:
+    """
+    queue RunEngine documents and insert them from a background thread
+
+    Subscribe an instance to the RunEngine in place of ``db.insert``.
+    The RunEngine thread only puts each document on a queue.
+    A single worker thread (so document order is preserved)
+    takes documents from the queue in batches.  Consecutive
+    ``event`` (same descriptor) and ``datum`` (same resource)
+    documents are packed into ``event_page`` and ``datum_page``
+    documents which the database writes with ``insert_many``.
+
+    When a ``stop`` document arrives, everything queued is written.
+
+    If the database cannot be reached, the documents of that run
+    not yet inserted are spilled, in order, to a local file, one file
+    per run, named by the run's ``uid``::
+
+        <spill_path>/<uid>.jsonl
+
+    The file starts with the run's ``start`` document (even if it was
+    inserted) so the run can be identified.  Each line is ``[name, doc]``
+    in JSON.  Replay them later with
+    :func:`instrument.framework.document_spool.replay_spool`
+    (it skips the documents already in the catalog).
+
+    PARAMETERS
+
+    insert : callable
+        ``insert(name, doc)``, such as ``db.insert``
+    spill_path : str
+        directory for spill files (created as needed)
+    max_queue : int
+        back-pressure limit: the RunEngine thread blocks
+        when this many documents are waiting to be written
+        (default: 10000)
+    batch_size : int
+        maximum number of documents written as one batch
+        (default: 500)
+    flush_interval : float
+        maximum time (s) a document waits in a partial batch
+        (default: 0.5)
+    pack_pages : bool
+        pack events and datums into pages (default: True)
+
+    USAGE::
+
+        db_writer = BufferedDocumentWriter(db.insert, spill_path="/tmp/spill")
+        RE.subscribe(db_writer)
+        ...
+        db_writer.flush()    # wait until all documents are written
+    """
+
+    def __init__(
+        self,
+        insert,
+        spill_path,
+        max_queue=10000,
+        batch_size=500,
+        flush_interval=0.5,
+        pack_pages=True,
+    ):
+        self.insert = insert
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pack_pages = pack_pages
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._run_start = None  # start document of this run
+        self._spilling = False
+        self.spill_files = []
+
+        self._worker = threading.Thread(
+            target=self._work, name="BufferedDocumentWriter", daemon=True
+        )
+        self._worker.start()
+        atexit.register(self.flush, timeout=30)
+
+    def __call__(self, name, doc):
+        """RunEngine callback: queue the document (blocks if queue is full)"""
+        try:
+            self._queue.put_nowait((name, doc))
+        except queue.Full:
+            logger.warning(
+                "document writer queue full (%d), waiting for database",
+                self._queue.maxsize,
+            )
+            self._queue.put((name, doc))
+
+    @property
+    def pending(self):
+        """number of documents not yet written"""
+        return self._queue.unfinished_tasks
+
+    def flush(self, timeout=None):
+        """
+        wait until all queued documents are written (or spilled)
+
+        Returns ``True`` if all documents were handled before ``timeout`` (s).
+        """
+        if timeout is None:
+            self._queue.join()
+            return True
+        t_end = time.time() + timeout
+        done = self._queue.all_tasks_done      # condition used by queue.join()
+        with done:
+            while self._queue.unfinished_tasks > 0:
+                remaining = t_end - time.time()
+                if remaining <= 0:
+                    return False
+                done.wait(remaining)
+        return True
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+            t_end = time.time() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1][0] != "stop":
+                try:
+                    batch.append(self._queue.get(timeout=max(0, t_end - time.time())))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception as exc:
+                logger.exception("document writer failed: %s", exc)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch):
+        pending = []
+        for name, doc in batch:
+            if name == "start":
+                self._write(pending)
+                pending = []
+                self._run_start = doc
+                self._spilling = False    # try the database again
+            pending.append((name, doc))
+        self._write(pending)
+
+    def _pack(self, documents):
+        """
+        pack consecutive events (same descriptor) & datums (same resource)
+
+        Returns list of ``(name, doc, n)`` where ``n`` is
+        the number of original documents in ``doc``.
+        """
+        if not self.pack_pages:
+            return [(name, doc, 1) for name, doc in documents]
+
+        def key(name, doc):
+            if name == "event":
+                return ("event", doc["descriptor"])
+            if name == "datum":
+                return ("datum", doc["resource"])
+            return None
+
+        result = []
+        group = []
+
+        def close_group():
+            docs = [d for _, d in group]
+            if len(group) == 1:
+                result.append((group[0][0], docs[0], 1))
+            elif group[0][0] == "event":
+                result.append(("event_page", event_model.pack_event_page(*docs), len(docs)))
+            else:
+                result.append(("datum_page", event_model.pack_datum_page(*docs), len(docs)))
+            group.clear()
+
+        for name, doc in documents:
+            k = key(name, doc)
+            if group and k != key(*group[0]):
+                close_group()
+            if k is None:
+                result.append((name, doc, 1))
+            else:
+                group.append((name, doc))
+        if group:
+            close_group()
+        return result
+
+    def _write(self, documents):
+        if len(documents) == 0:
+            return
+        if not self._spilling:
+            written = 0
+            for name, doc, n in self._pack(documents):
+                try:
+                    self.insert(name, doc)
+                except Exception as exc:
+                    logger.error(
+                        "database insert of '%s' document failed: %s", name, exc
+                    )
+                    self._spilling = True
+                    break
+                written += n
+            if not self._spilling:
+                return
+            documents = documents[written:]     # not inserted
+        if len(documents) > 0:
+            self._spill(documents)
+
+    def _spill(self, documents):
+        os.makedirs(self.spill_path, exist_ok=True)
+        uid = (self._run_start or {}).get("uid", "no_run")
+        fname = os.path.join(self.spill_path, f"{uid}.jsonl")
+        if fname not in self.spill_files:
+            self.spill_files.append(fname)
+            logger.warning("spilling documents to local file: %s", fname)
+            if self._run_start is not None and documents[0][0] != "start":
+                # replay needs the start document first
+                documents = [("start", self._run_start)] + documents
+        with open(fname, "a") as fp:
+            write_document_lines(fp, documents)
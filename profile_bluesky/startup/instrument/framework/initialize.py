@@ -4,11 +4,14 @@ initialize the bluesky framework
 
 __all__ = [
     "bec",
+    "bec_throttle",
     "bp",
     "bpp",
     "bps",
     "callback_db",
     "db",
+    "db_spool",
+    "db_writer",
     "np",
     "peaks",
     "RE",
@@ -30,6 +33,9 @@ from bluesky.utils import get_history
 from bluesky.utils import PersistentDict
 from bluesky.utils import ProgressBarManager
 from bluesky.utils import ts_msg_hook
+from .document_spool import DocumentSpool
+from .document_writer import BufferedDocumentWriter
+from .throttled_callback import ThrottledCallback
 from IPython import get_ipython
 from ophyd.signal import EpicsSignalBase
 import databroker
@@ -89,7 +95,18 @@ db = databroker.catalog["mongodb_config"].v1
 
 # Subscribe metadatastore to documents.
 # If this is removed, data is not saved to metadatastore.
-callback_db["db"] = RE.subscribe(db.insert)
+# Documents are queued and written in batches from a background thread.
+# If mongodb is unreachable, documents are spilled to local files.
+db_writer = BufferedDocumentWriter(
+    db.insert,
+    os.path.join(os.path.dirname(md_path), "Bluesky_spill"),
+)
+callback_db["db"] = RE.subscribe(db_writer)
+
+# Keep a local, durable copy of every run (also a fast cache of recent runs).
+# Push spooled runs to a catalog later with:  replay_spool(path, db)
+db_spool = DocumentSpool(os.path.join(os.path.dirname(md_path), "Bluesky_spool"))
+callback_db["spool"] = RE.subscribe(db_spool)
 
 # Set up SupplementalData.
 sd = SupplementalData()
@@ -103,8 +120,11 @@ RE.waiting_hook = pbar_manager
 get_ipython().register_magics(BlueskyMagics)
 
 # Set up the BestEffortCallback.
+# Plot & table updates are rate-limited, monitor streams decimated.
+# Change with:  bec_throttle.refresh_hz = 2
 bec = BestEffortCallback()
-callback_db["bec"] = RE.subscribe(bec)
+bec_throttle = ThrottledCallback(bec, refresh_hz=10, monitor_decimation=10)
+callback_db["bec"] = RE.subscribe(bec_throttle)
 peaks = bec.peaks  # just as alias for less typing
 bec.disable_baseline()
 
@@ -0,0 +1,47 @@
+"""
+in-process facts about the current (or most recent) run
+"""
+
+__all__ = [
+    "run_context",
+]
+
+from ..session_logs import logger
+logger.info(__file__)
+
+from .initialize import RE
+from bluesky import plan_stubs as bps
+import time
+
+
+class RunContext(dict):
+    """
+    facts about the current (or most recent) run, kept in this process
+
+    Plans open their run with ``run_context.open_run()``, which
+    records the ``uid`` returned by the RunEngine and the ``scan_id``.
+    Plans may add other facts.  Later steps (such as post-scan
+    metadata) read them here, with no database query.
+
+    EXAMPLE::
+
+        uid = yield from run_context.open_run(md=md)
+        ...
+        yield from bps.close_run()
+        run_context["uid"], run_context["scan_id"]
+    """
+
+    def open_run(self, md=None, **facts):
+        """plan: open a run and record its facts"""
+        uid = yield from bps.open_run(md=md)
+        self.clear()
+        self.update(
+            uid=uid,
+            scan_id=RE.md.get("scan_id"),
+            time=time.time(),
+        )
+        self.update(facts)
+        return uid
+
+
+run_context = RunContext()
@@ -0,0 +1,112 @@
+"""
+rate-limit the documents sent to a display callback (such as BestEffortCallback)
+"""
+
+__all__ = [
+    "ThrottledCallback",
+]
+
+from ..session_logs import logger
+logger.info(__file__)
+
+import event_model
+import time
+
+
+class ThrottledCallback:
+    """
+    forward documents to a (display) callback at a limited rate
+
+    Wrap the display callback and subscribe the wrapper to the RunEngine.
+    Other subscribers still receive every document: only the wrapped
+    callback sees fewer events.
+
+    * All documents other than events are forwarded at once.
+    * Events of the ``primary`` stream are forwarded at most
+      ``refresh_hz`` times per second (per descriptor).
+      Events in between are coalesced: only the most recent
+      one is kept and it is forwarded with the next update
+      or at the end of the run.
+    * Events of other streams (such as ``monitor_during`` streams)
+      are first decimated (only every ``monitor_decimation``-th
+      event is kept), then rate-limited the same way.
+
+    Since the wrapped callback sees fewer events, any statistics
+    it computes (such as ``bec.peaks``) are from the displayed events.
+
+    PARAMETERS
+
+    callback : callable
+        ``callback(name, doc)`` to be throttled, such as ``bec``
+    refresh_hz : float
+        maximum display update rate (per stream), ``None`` or 0 means
+        no rate limit (default: 10)
+    monitor_decimation : int
+        keep every N-th event of non-primary streams (default: 10)
+
+    USAGE::
+
+        bec = BestEffortCallback()
+        bec_throttle = ThrottledCallback(bec, refresh_hz=5)
+        RE.subscribe(bec_throttle)
+    """
+
+    primary_stream = "primary"
+
+    def __init__(self, callback, refresh_hz=10, monitor_decimation=10):
+        self.callback = callback
+        self.refresh_hz = refresh_hz
+        self.monitor_decimation = max(1, int(monitor_decimation))
+        self._clear()
+
+    def _clear(self):
+        self._streams = {}      # descriptor uid: stream name
+        self._counts = {}       # descriptor uid: number of events received
+        self._last = {}         # descriptor uid: time of last forwarded event
+        self._pending = {}      # descriptor uid: latest coalesced event
+
+    @property
+    def interval(self):
+        """minimum time (s) between forwarded events of a stream"""
+        return 1.0 / self.refresh_hz if self.refresh_hz else 0
+
+    def __call__(self, name, doc):
+        if name == "event":
+            self._event(doc)
+        elif name == "event_page":
+            for event in event_model.unpack_event_page(doc):
+                self._event(event)
+        else:
+            if name == "start":
+                self._clear()
+            elif name == "descriptor":
+                self._streams[doc["uid"]] = doc.get("name")
+                self._counts[doc["uid"]] = 0
+            elif name == "stop":
+                self.flush()
+            self.callback(name, doc)
+            if name == "stop":
+                self._clear()
+
+    def _event(self, doc):
+        key = doc["descriptor"]
+        n = self._counts.get(key, 0)
+        self._counts[key] = n + 1
+        if self._streams.get(key) != self.primary_stream:
+            if n % self.monitor_decimation != 0:
+                return
+
+        now = time.time()
+        if now - self._last.get(key, 0) >= self.interval:
+            self._pending.pop(key, None)
+            self._last[key] = now
+            self.callback("event", doc)
+        else:
+            self._pending[key] = doc
+
+    def flush(self):
+        """forward the coalesced events now"""
+        for key, doc in list(self._pending.items()):
+            self._last[key] = time.time()
+            self.callback("event", doc)
+        self._pending.clear()
@@ -7,8 +7,10 @@ from .alignments import *
 from .flyscan import *
 from .flux_calculations import *
 from .lineup_tweak import * 
+from .monitor_bins import *
 from .move_diodes import *
 from .move_sample import *
 from .pv_registers import *
 from .shutters import *
 from .xpcs_acquire import *
+from .xpcs_series import *
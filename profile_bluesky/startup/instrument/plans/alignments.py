@@ -17,9 +17,13 @@ logger.info(__file__)
 
 from bluesky import plans as bp
 from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
 
 from ..devices import actuator_flux, att, default_counter, pind4, lakeshore, samplestage
 from ..devices import shutter, scaler1, shutter_override
+from ..utils.alignment_cache import alignment_cache, warm_range
+from .functions import monochromator_energy
+from .peak_fit import fit_peak, peak_found
 from .shutters import sb, bb
 
 
@@ -69,9 +73,25 @@ def lup(channel,
         pos_stop,
         num_pts,
         count_time,
-        md=None):
+        md=None,
+        sample=None,
+        use_cache=True,
+        peak_factor=4,
+        width_factor=0.8):
+    """
+    relative scan of a scaler channel, starts from a cached result
+
+    With ``use_cache``, a recent result for this motor, channel, energy,
+    and ``sample`` (see ``alignment_cache``) narrows the range and the
+    number of points.  If no peak is fitted there, the full range is
+    scanned.  A fitted peak that passes the checks of ``lineup()``
+    (``peak_factor``, ``width_factor``) is saved in the cache and
+    returned (``None`` if no peak).
+    """
+    energy = monochromator_energy()
+    entry = alignment_cache.get(motor, channel, energy, sample) if use_cache else None
+    narrow = warm_range(entry, motor.position, pos_start, pos_stop, num_pts)
 
-    
     _md = {}
     _md["plan_name"] = "lup"
     _md["channel_name"] = channel.name
@@ -81,21 +101,52 @@ def lup(channel,
     _md["pos_stop"] = pos_stop
     _md.update(md or {})
 
+    def scan(pos_start, pos_stop, num_pts, warm):
+        x, y = [], []
+
+        def collect(name, doc):
+            data = doc["data"]
+            if motor.name in data and channel.name in data:
+                x.append(data[motor.name])
+                y.append(data[channel.name])
+
+        _md["warm_start"] = warm
+        yield from bpp.subs_wrapper(
+            bp.rel_scan(
+                [scaler1, lakeshore],
+                motor,
+                pos_start,
+                pos_stop,
+                num_pts,
+                md=_md
+            ),
+            {"event": [collect]})
+        result = fit_peak(x, y) if len(x) > 0 else None
+        if not peak_found(result, x, y, peak_factor, width_factor):
+            logger.warning("lup: no peak found in %g..%g", pos_start, pos_stop)
+            return None
+        return result
+
     yield from sb()
     original_stage_sigs = dict(scaler1.stage_sigs)
     scaler1.stage_sigs["preset_time"] = count_time
     scaler1.stage_sigs["count_mode"] = "OneShot"
     scaler1.stage_sigs["auto_count_delay"] = 1
     scaler1.select_channels([channel.name])
-    yield from bp.rel_scan(
-        [scaler1, lakeshore],
-        motor,
-        pos_start,
-        pos_stop,
-        num_pts,
-        md=_md
-        )
-    scaler1.select_channels(None)    # selects all named channels again
-    scaler1.stage_sigs = dict(original_stage_sigs)
+    result = None
+    try:
+        if narrow is not None:
+            logger.info(
+                "lup: warm start from cached center %g: range %g..%g, %d points",
+                entry["center"], *narrow)
+            result = yield from scan(*narrow, warm=True)
+        if result is None:
+            result = yield from scan(pos_start, pos_stop, num_pts, warm=False)
+    finally:
+        scaler1.select_channels(None)    # selects all named channels again
+        scaler1.stage_sigs = dict(original_stage_sigs)
+    if result is not None:
+        alignment_cache.put(
+            motor, channel, result["center"], result["fwhm"], energy, sample)
     yield from bb()
-
+    return result
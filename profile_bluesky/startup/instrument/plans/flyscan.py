@@ -4,14 +4,20 @@ Bluesky plans for fly scan
 """
 
 __all__ = [
+    "fly_lineup",
     "flyscan_spinner",
 ]
 
 from instrument.session_logs import logger
 logger.info(__file__)
 
-from ..devices import flyscan
+from ..devices import flyscan, flyz, scaler1, timebase
+from .peak_fit import fit_peak, peak_found
 from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+import numpy as np
+import pyRestTable
+import threading
 
 
 
@@ -20,3 +26,156 @@ def flyscan_spinner(start_pos, end_pos, fly_speed):
     yield from flyscan.setup(start_pos, end_pos, fly_speed)
     yield from bps.abs_set(flyscan, "taxi", wait=True)
     yield from bps.abs_set(flyscan, "fly", wait=False)
+
+
+def fly_profile(positions, counts, clocks, clock_hz):
+    """
+    intensity profile from fly scan samples, by time correlation
+
+    Each update of the scaler's clock (timebase) channel is one
+    sample: counts (the counter's latest value, unchanged values are
+    not posted) over the time counted (clock / ``clock_hz``), at the
+    motor position interpolated at the middle of that counting time.
+    Counting time comes from the clock, not from update times, so
+    partial updates and the dead time between counts are handled.
+
+    PARAMETERS
+
+    positions : [(timestamp, position)]
+        motor readback updates
+    counts : [(timestamp, counts)]
+        counter updates
+    clocks : [(timestamp, clock ticks)]
+        clock (timebase) channel updates
+    clock_hz : float
+        scaler clock frequency
+
+    Returns (x, rate, error) arrays: position, count rate (1/s),
+    and its Poisson uncertainty.
+    """
+    if len(positions) < 2 or len(counts) == 0 or len(clocks) == 0:
+        return np.array([]), np.array([]), np.array([])
+    tp, xp = np.array(sorted(positions), dtype=float).T
+    tc, yc = np.array(sorted(counts), dtype=float).T
+    tk, ck = np.array(sorted(clocks), dtype=float).T
+    elapsed = ck / clock_hz
+    # latest counter value posted at (or before) each clock update
+    k = np.searchsorted(tc, tk, side="right") - 1
+    t_mid = tk - elapsed / 2
+    keep = (k >= 0) & (elapsed > 0) & (t_mid >= tp.min()) & (t_mid <= tp.max())
+    x = np.interp(t_mid[keep], tp, xp)
+    n, dt = yc[k[keep]], elapsed[keep]
+    return x, n / dt, np.sqrt(np.maximum(n, 1)) / dt
+
+
+def fly_lineup(counter, start_pos, end_pos, fly_speed,
+               count_time=0.05, shape="gaussian", peak_factor=4,
+               width_factor=0.8, md={}):
+    """
+    align ``flyz`` by flying through the peak while the scaler autocounts
+
+    The scaler autocounts (``count_time`` per interval) during one
+    PSO fly of ``flyz`` at constant ``fly_speed``.  Counter, clock,
+    and motor readback updates are recorded (as monitor streams of
+    one run), then the profile is rebuilt by time correlation (see
+    ``fly_profile()``) and a peak is fitted.  ``flyz`` is moved to
+    the center if a peak is found (same checks as ``lineup()``),
+    otherwise back.
+
+    There is no position-triggered (MCS) counter here, so the position
+    resolution is about ``fly_speed * count_time``.
+
+    PARAMETERS
+
+    counter : scaler channel signal
+        channel of ``scaler1`` to be maximized
+    start_pos, end_pos : float
+        fly range of ``flyz``
+    fly_speed : float
+        speed of ``flyz`` (mm/s)
+    count_time : float (default: 0.05)
+        scaler autocount time (s)
+    shape : str (default: "gaussian")
+        peak model: "gaussian" or "lorentzian"
+    peak_factor : float (default: 4)
+        maximum must be greater than 'peak_factor'*minimum
+    width_factor : float (default: 0.8)
+        fwhm must be less than 'width_factor'*range
+
+    Returns a dictionary with the fit results, ``aligned``, ``points``.
+
+    EXAMPLE::
+
+        result = RE(fly_lineup(pind4, -0.5, 0.5, 0.25))
+    """
+    start = flyz.position
+    positions, counts, clocks = [], [], []
+    lock = threading.Lock()
+
+    def record(store):
+        def cb(value=None, timestamp=None, **kwargs):
+            with lock:
+                store.append((timestamp, value))
+        return cb
+
+    _md = dict(md)
+    _md.update(dict(
+        purpose="alignment",
+        plan_name="fly_lineup",
+        detectors=[counter.name],
+        motors=[flyz.name],
+        plan_args=dict(
+            start_pos=start_pos, end_pos=end_pos, fly_speed=fly_speed,
+            count_time=count_time, shape=shape),
+    ))
+
+    old_sigs = dict(scaler1.stage_sigs)
+    scaler1.stage_sigs["count_mode"] = "AutoCount"
+    scaler1.stage_sigs["auto_count_time"] = count_time
+    scaler1.select_channels([counter.name])
+
+    @bpp.stage_decorator([scaler1])
+    @bpp.run_decorator(md=_md)
+    @bpp.monitor_during_decorator([flyz.user_readback, counter, timebase])
+    def _inner():
+        yield from flyscan.setup(start_pos, end_pos, fly_speed)
+        yield from bps.abs_set(flyscan, "taxi", wait=True)
+        cids = [
+            (signal, signal.subscribe(record(store), run=False))
+            for signal, store in (
+                (flyz.user_readback, positions),
+                (counter, counts),
+                (timebase, clocks),
+            )
+        ]
+        try:
+            yield from bps.abs_set(flyscan, "fly", wait=True)
+        finally:
+            for signal, cid in cids:
+                signal.unsubscribe(cid)
+
+    try:
+        yield from _inner()
+    finally:
+        scaler1.select_channels()
+        scaler1.stage_sigs = old_sigs
+
+    x, y, error = fly_profile(positions, counts, clocks, scaler1.freq.get())
+    result = fit_peak(x, y, shape=shape, weights=1/error) if len(x) > 0 else None
+
+    aligned = peak_found(result, x, y, peak_factor, width_factor)
+    final = result["center"] if aligned else start
+    result = dict(result or {})
+    result.update(dict(aligned=aligned, points=len(x), start=start))
+
+    table = pyRestTable.Table()
+    table.labels = ("key", "value")
+    table.addRow(("axis", flyz.name))
+    table.addRow(("detector", counter.name))
+    for key, value in result.items():
+        table.addRow((key, value))
+    logger.info(f"fly alignment results:\n{table}")
+
+    logger.info(f"moving {flyz.name} to {final}  (aligned: {aligned})")
+    yield from bps.mv(flyz, final)
+    return result
@@ -3,11 +3,44 @@
 various functions
 """
 
-__all__ = ["taylor_series", ]
+__all__ = ["monochromator_energy", "read_concurrently", "taylor_series", ]
 
 from instrument.session_logs import logger
 logger.info(__file__)
 
+from concurrent.futures import ThreadPoolExecutor
+from ..devices import monochromator
+
+
+def monochromator_energy():
+    """monochromator energy (keV), ``None`` if not available"""
+    try:
+        return monochromator.energy.position
+    except Exception:
+        return None
+
+
+def read_concurrently(**readers):
+    """
+    call each reader (such as ``signal.get``) in its own thread
+
+    Returns a dictionary with the same keys.  If a reader
+    raised an exception, the exception is the value.
+
+    EXAMPLE::
+
+        values = read_concurrently(current=aps.current.get, I0=I0Mon.get)
+    """
+    with ThreadPoolExecutor(max_workers=max(1, len(readers))) as pool:
+        futures = {k: pool.submit(f) for k, f in readers.items()}
+    results = {}
+    for k, future in futures.items():
+        try:
+            results[k] = future.result()
+        except Exception as exc:
+            results[k] = exc
+    return results
+
 
 def taylor_series(x, coefficients):
     """
@@ -4,6 +4,7 @@ Bluesky plans to move the sample stage and actuators
 """
 
 __all__ = """
+    adaptive_lineup
     lineup
     tw
 """.split()
@@ -11,28 +12,361 @@ __all__ = """
 from instrument.session_logs import logger
 logger.info(__file__)
 
-from bluesky import plans as bp
 from bluesky import plan_stubs as bps
-from ..framework import bec
+from bluesky import preprocessors as bpp
 from ophyd.scaler import ScalerCH, ScalerChannel
+from ..utils.alignment_cache import alignment_cache, warm_range
+from .functions import monochromator_energy
+from .peak_fit import fit_peak
+from .peak_fit import peak_found as _peak_found
+import numpy as np
 import pyRestTable
 
 
-def tw(counter, motor, delta):
+def _scaler_of(counter):
+    """the ScalerCH device of a scaler channel signal (or None)"""
+    obj = counter.parent
+    if isinstance(obj, ScalerChannel):
+        if hasattr(obj, "parent") and obj.parent is not None:
+            obj = obj.parent
+            if hasattr(obj, "parent") and isinstance(obj.parent, ScalerCH):
+                return obj.parent
+    return None
+
+
+def _position(axis):
+    if hasattr(axis, "position"):
+        return axis.position
+    return axis.get()
+
+
+def tw(counter, motors, deltas, time_s=0.1, final_time_s=None,
+       min_fraction=1/16, max_points=100, max_excursion=None, md={}):
     """
-    maximize a positioner using a motor and reading a scaler channel
+    maximize a counter by tweaking one or more motors (hill climb)
+
+    Like SPEC's interactive ``tw``, automated: each motor in turn
+    takes a step (first in the last direction that improved);
+    a step that improves the count rate (by more than its Poisson
+    uncertainty) is kept and the next step is longer, otherwise the
+    other direction is tried, then the step is halved.  Stops when
+    all steps are below ``min_fraction`` of their ``deltas``.
+    No trial position is more than ``max_excursion`` from the start
+    or outside of the motor's soft limits.
 
-    In SPEC, the `tw` command initiates an interactive session.
-    Automate that here, if possible.
+    Counts are short (``time_s``) far from the optimum.  As the steps
+    shrink, the count time grows (up to ``final_time_s``), and the
+    best position is counted again at the new time.  All points are
+    in one run.  The motors are moved to the best position.
+
+    PARAMETERS
+
+    counter : Signal or scaler channel object
+        detector or Signal to be maximized (its scaler is triggered)
+    motors : movable or [movable]
+        motor(s) to tweak
+    deltas : float or [float]
+        first step size of each motor
+    time_s : float (default: 0.1)
+        shortest count time (scaler channels only)
+    final_time_s : float (default: 4*time_s)
+        longest count time, used near the optimum
+    min_fraction : float (default: 1/16)
+        smallest step, as fraction of ``deltas``
+    max_points : int (default: 100)
+        most points to count
+    max_excursion : float or [float] (default: 10*deltas)
+        farthest any motor may go from its starting position
+
+    Returns a dictionary with ``positions`` (by motor name),
+    ``rate``, ``points``, and ``count_time``.
+
+    EXAMPLE::
+
+        RE(tw(pind4, [samplestage.x, samplestage.z], [0.05, 0.05]))
     """
-    # Usage:  tw mot [mot2 ...] delta [delta2 ...] [count_time]
-    raise NotImplementedError("Need to write the Bluesky tw() plan")
+    if not isinstance(motors, (list, tuple)):
+        motors = [motors]
+    if not isinstance(deltas, (list, tuple)):
+        deltas = [deltas] * len(motors)
+    if len(deltas) != len(motors):
+        raise ValueError(f"need one delta for each motor, received {deltas}")
+    deltas = [abs(d) for d in deltas]
+    if max_excursion is None:
+        max_excursion = [10 * d for d in deltas]
+    elif not isinstance(max_excursion, (list, tuple)):
+        max_excursion = [max_excursion] * len(motors)
+    start = [_position(m) for m in motors]
+    bounds = []
+    for motor, p0, excursion in zip(motors, start, max_excursion):
+        lo, hi = p0 - abs(excursion), p0 + abs(excursion)
+        low, high = getattr(motor, "limits", (0, 0))
+        if low < high:      # EPICS: equal limits means no limits
+            lo, hi = max(lo, low), min(hi, high)
+        bounds.append((lo, hi))
+    scaler = _scaler_of(counter)
+    final_time_s = final_time_s or 4 * time_s
+    steps = list(deltas)
+    directions = [1] * len(motors)
+    trajectory = []
+    best = dict(position=list(start), rate=None, sigma=0)
+    count = dict(time=time_s)
+
+    _md = dict(md)
+    _md.update(dict(
+        purpose="alignment",
+        plan_name="tw",
+        detectors=[counter.name],
+        motors=[m.name for m in motors],
+        plan_args=dict(
+            deltas=deltas, time_s=time_s, final_time_s=final_time_s,
+            min_fraction=min_fraction, max_points=max_points,
+            max_excursion=list(max_excursion)),
+    ))
+
+    def count_time():
+        if scaler is None:
+            return time_s
+        refined = min(d / s for d, s in zip(deltas, steps))
+        return min(final_time_s, time_s * max(refined, 1))
 
+    def measure(position):
+        """count at position, return (rate, uncertainty)"""
+        args = []
+        for motor, value in zip(motors, position):
+            args += [motor, value]
+        yield from bps.mv(*args)
+        yield from bps.trigger(scaler or counter, wait=True)
+        yield from bps.create()
+        reading = yield from bps.read(counter)
+        for motor in motors:
+            yield from bps.read(motor)
+        yield from bps.save()
+        value = reading[counter.name]["value"]
+        if scaler is None:
+            rate, sigma = value, 0
+        else:
+            rate = value / count["time"]
+            sigma = np.sqrt(max(value, 1)) / count["time"]
+        trajectory.append((list(position), rate))
+        return rate, sigma
+
+    def set_count_time():
+        """longer counts near the optimum: recount the best position"""
+        t = count_time()
+        if scaler is not None and t != count["time"]:
+            count["time"] = t
+            yield from bps.mv(scaler.preset_time, t)
+            best["rate"], best["sigma"] = yield from measure(best["position"])
+
+    def converged():
+        return all(s < d * min_fraction for d, s in zip(deltas, steps))
+
+    @bpp.run_decorator(md=_md)
+    def _inner():
+        best["rate"], best["sigma"] = yield from measure(best["position"])
+        while not converged() and len(trajectory) < max_points:
+            for i in range(len(motors)):
+                if steps[i] < deltas[i] * min_fraction:
+                    continue
+                improved = False
+                for direction in (directions[i], -directions[i]):
+                    if len(trajectory) >= max_points:
+                        break
+                    trial = list(best["position"])
+                    trial[i] += direction * steps[i]
+                    lo, hi = bounds[i]
+                    if not (lo <= trial[i] <= hi):
+                        continue
+                    rate, sigma = yield from measure(trial)
+                    if rate > best["rate"] + np.hypot(sigma, best["sigma"]):
+                        best.update(position=trial, rate=rate, sigma=sigma)
+                        directions[i] = direction
+                        steps[i] = min(1.5 * steps[i], 4 * deltas[i])
+                        improved = True
+                        break
+                if not improved:
+                    steps[i] /= 2
+                yield from set_count_time()
+
+    if scaler is not None:
+        old_sigs = dict(scaler.stage_sigs)
+        scaler.stage_sigs["preset_time"] = time_s
+        scaler.select_channels([counter.name])
+    try:
+        if scaler is not None:
+            yield from bpp.stage_wrapper(_inner(), [scaler])
+        else:
+            yield from _inner()
+    finally:
+        if scaler is not None:
+            scaler.select_channels()
+            scaler.stage_sigs = old_sigs
+
+    result = dict(
+        positions={m.name: p for m, p in zip(motors, best["position"])},
+        rate=best["rate"],
+        points=len(trajectory),
+        count_time=count["time"],
+    )
 
-def lineup(counter, axis, minus, plus, npts, time_s=0.1, peak_factor=4, width_factor=0.8,_md={}):
+    table = pyRestTable.Table()
+    table.labels = ("key", "value")
+    table.addRow(("detector", counter.name))
+    for key, value in result.items():
+        table.addRow((key, value))
+    logger.info(f"tweak results:\n{table}")
+
+    args = []
+    for motor, value in zip(motors, best["position"]):
+        args += [motor, value]
+    yield from bps.mv(*args)
+    return result
+
+
+def adaptive_lineup(counter, axis, minus, plus, npts=11,
+                    tolerance=None, max_points=None, shape="gaussian",
+                    peak_factor=4, width_factor=0.8, md={}):
+    """
+    align an axis to a peak of a counter, choosing points adaptively
+
+    First, a coarse scan of ``npts`` points from ``minus`` to ``plus``
+    (relative to the starting position).  Then a peak model (``shape``:
+    gaussian or lorentzian) is fitted and points are added on the
+    flanks of the fitted peak (where they tell most about the center)
+    until the center is known to ``tolerance`` or ``max_points`` have
+    been counted.  All points are in one run.  The axis is moved to the
+    fitted center if a peak is found, otherwise back to the start.
+
+    PARAMETERS
+
+    counter : Signal or scaler channel object
+        detector or Signal to be maximized (its scaler is triggered)
+    axis : movable
+        Signal or EpicsMotor to use for alignment, the independent axis
+    minus, plus : float
+        range of the coarse scan, offsets from the starting position
+    npts : int (default: 11)
+        number of points in the coarse scan
+    tolerance : float (default: range/200)
+        stop when the uncertainty of the center is less
+    max_points : int (default: 2*npts)
+        most points to count
+    shape : str (default: "gaussian")
+        peak model: "gaussian" or "lorentzian"
+    peak_factor : float (default: 4)
+        maximum must be greater than 'peak_factor'*minimum
+    width_factor : float (default: 0.8)
+        fwhm must be less than 'width_factor'*range
+
+    Returns a dictionary with the fit results (``center``, ``fwhm``,
+    ``center_err``, ...), ``aligned`` (bool) and ``points``.
+
+    EXAMPLE::
+
+        result = RE(adaptive_lineup(pind4, samplestage.x, -0.5, 0.5, 11))
+    """
+    scaler = _scaler_of(counter)
+    start = _position(axis)
+    lo_limit = start + min(minus, plus)
+    hi_limit = start + max(minus, plus)
+    tolerance = tolerance or abs(plus - minus) / 200
+    max_points = max_points or 2 * npts
+    x, y = [], []
+
+    _md = dict(md)
+    _md.update(dict(
+        purpose="alignment",
+        plan_name="adaptive_lineup",
+        detectors=[counter.name],
+        motors=[axis.name],
+        plan_args=dict(
+            minus=minus, plus=plus, npts=npts,
+            tolerance=tolerance, max_points=max_points, shape=shape),
+    ))
+
+    def measure(position):
+        yield from bps.mv(axis, position)
+        yield from bps.trigger(scaler or counter, wait=True)
+        yield from bps.create()
+        reading = yield from bps.read(counter)
+        yield from bps.read(axis)
+        yield from bps.save()
+        x.append(position)
+        y.append(reading[counter.name]["value"])
+
+    def peak_found(result):
+        return _peak_found(result, x, y, peak_factor, width_factor)
+
+    def next_points(result):
+        center, fwhm = result["center"], result["fwhm"]
+        candidates = center + fwhm * np.array([-0.5, 0.5, -0.25, 0.25, 0])
+        new = []
+        for position in candidates:
+            if not (lo_limit <= position <= hi_limit):
+                continue
+            if min(abs(np.array(x + new) - position)) < tolerance:
+                continue
+            new.append(float(position))
+        return new
+
+    @bpp.run_decorator(md=_md)
+    def _inner():
+        for position in np.linspace(start + minus, start + plus, npts):
+            yield from measure(float(position))
+        result = fit_peak(x, y, shape=shape)
+        while (
+            peak_found(result)
+            and result["center_err"] > tolerance
+            and len(x) < max_points
+        ):
+            positions = next_points(result)[:max_points - len(x)]
+            if len(positions) == 0:
+                break
+            for position in positions:
+                yield from measure(position)
+            result = fit_peak(x, y, shape=shape)
+        fit["result"] = result
+
+    fit = dict(result=None)
+    if scaler is not None:
+        yield from bpp.stage_wrapper(_inner(), [scaler])
+    else:
+        yield from _inner()
+    result = fit["result"]
+
+    aligned = peak_found(result)
+    final = result["center"] if aligned else start
+    result = dict(result or {})
+    result.update(dict(aligned=aligned, points=len(x), start=start))
+
+    table = pyRestTable.Table()
+    table.labels = ("key", "value")
+    table.addRow(("axis", axis.name))
+    table.addRow(("detector", counter.name))
+    for key, value in result.items():
+        table.addRow((key, value))
+    logger.info(f"alignment scan results:\n{table}")
+
+    logger.info(f"moving {axis.name} to {final}  (aligned: {aligned})")
+    yield from bps.mv(axis, final)
+    return result
+
+
+def lineup(counter, axis, minus, plus, npts, time_s=0.1, peak_factor=4, width_factor=0.8,
+           tolerance=None, shape="gaussian", sample=None, use_cache=True, _md={}):
     """
     lineup and center a given axis, relative to current position
 
+    Uses ``adaptive_lineup()``: a coarse scan of about half of ``npts``,
+    then points near the fitted peak until its center is known to
+    ``tolerance``, at most ``npts`` points in all.
+
+    With ``use_cache``, a recent result for this axis, counter,
+    energy, and ``sample`` (see ``alignment_cache``) narrows the
+    range and the number of points.  If no peak is found there, the
+    full range is scanned.  Each aligned result is saved in the cache.
+
     PARAMETERS
     
     counter : Signal or scaler channel object
@@ -48,7 +382,7 @@ def lineup(counter, axis, minus, plus, npts, time_s=0.1, peak_factor=4, width_fa
         last point of scan at this offset from starting position
     
     npts : int
-        number of data points in the scan
+        most data points in the scan
     
     time_s : float (default: 0.1)
         count time per step
@@ -59,87 +393,63 @@ def lineup(counter, axis, minus, plus, npts, time_s=0.1, peak_factor=4, width_fa
     width_factor : float (default: 0.8)
         fwhm must be less than 'width_factor'*plot_range
 
+    tolerance : float (default: range/200)
+        required uncertainty of the peak center
+
+    shape : str (default: "gaussian")
+        peak model: "gaussian" or "lorentzian"
+
+    sample : str (default: None)
+        sample or holder identifier, part of the cache key
+
+    use_cache : bool (default: True)
+        start from a recent alignment result, if available
+
+    Returns the dictionary from ``adaptive_lineup()``.
+
     EXAMPLE:
 
         RE(lineup(diode, foemirror.theta, -30, 30, 30, 1.0))
     """
-     # first, determine if counter is part of a ScalerCH device
-    scaler = None
-    obj = counter.parent
-    if isinstance(counter.parent, ScalerChannel):
-        if hasattr(obj, "parent") and obj.parent is not None:
-            obj = obj.parent
-            if hasattr(obj, "parent") and isinstance(obj.parent, ScalerCH):
-                scaler = obj.parent
-
+    scaler = _scaler_of(counter)
+    energy = monochromator_energy()
     if scaler is not None:
-        old_sigs = scaler.stage_sigs
+        old_sigs = dict(scaler.stage_sigs)
         scaler.stage_sigs["preset_time"] = time_s
         scaler.select_channels([counter.name])
 
-    if hasattr(axis, "position"):
-        old_position = axis.position
-    else:
-        old_position = axis.get()
-
-    def peak_analysis():
-        aligned = False
-        if counter.name in bec.peaks["cen"]:
-            table = pyRestTable.Table()
-            table.labels = ("key", "value")
-            table.addRow(("axis", axis.name))
-            table.addRow(("detector", counter.name))
-            table.addRow(("starting position", old_position))
-            for key in bec.peaks.ATTRS:
-                table.addRow((key, bec.peaks[key][counter.name]))
-            logger.info(f"alignment scan results:\n{table}")
-
-            lo = bec.peaks["min"][counter.name][-1]  # [-1] means detector
-            hi = bec.peaks["max"][counter.name][-1]  # [0] means axis
-            fwhm = bec.peaks["fwhm"][counter.name]
-            final = bec.peaks["cen"][counter.name]
-
-            ps = list(bec._peak_stats.values())[0][counter.name]    # PeakStats object
-            # get the X data range as received by PeakStats
-            x_range = abs(max(ps.x_data) - min(ps.x_data))
-
-            if final is None:
-                logger.error(f"centroid is None")
-                final = old_position
-            elif fwhm is None:
-                logger.error(f"FWHM is None")
-                final = old_position
-            elif hi < peak_factor*lo:
-                logger.error(f"no clear peak: {hi} < {peak_factor}*{lo}")
-                final = old_position
-            elif fwhm > width_factor*x_range:
-                logger.error(f"FWHM too large: {fwhm} > {width_factor}*{x_range}")
-                final = old_position
-            else:
-                aligned = True
-            
-            logger.info(f"moving {axis.name} to {final}  (aligned: {aligned})")
-            yield from bps.mv(axis, final)
-        else:
-            logger.error("no statistical analysis of scan peak!")
-            yield from bps.null()
-
-        # too sneaky?  We're modifying this structure locally
-        bec.peaks.aligned = aligned
-        bec.peaks.ATTRS =  ('com', 'cen', 'max', 'min', 'fwhm')
+    def attempt(minus, plus, npts, warm):
+        md = dict(_md)
+        md["warm_start"] = warm
+        return (yield from adaptive_lineup(
+            counter, axis, minus, plus,
+            npts=max(7, npts//2),
+            tolerance=tolerance,
+            max_points=max(npts, 7),
+            shape=shape,
+            peak_factor=peak_factor,
+            width_factor=width_factor,
+            md=md))
 
-    md = dict(_md)
-    md["purpose"] = "alignment"
-    yield from bp.rel_scan([counter], axis, minus, plus, npts, md=md)
-    yield from peak_analysis()
+    try:
+        result = None
+        entry = alignment_cache.get(axis, counter, energy, sample) if use_cache else None
+        narrow = warm_range(entry, _position(axis), minus, plus, npts)
+        if narrow is not None:
+            logger.info(
+                "%s: warm start from cached center %g (fwhm %g): range %g..%g, %d points",
+                axis.name, entry["center"], entry["fwhm"], *narrow)
+            result = yield from attempt(*narrow, warm=True)
+            if not result["aligned"]:
+                logger.warning("%s: no peak near the cached center, scanning the full range", axis.name)
+        if result is None or not result["aligned"]:
+            result = yield from attempt(minus, plus, npts, warm=False)
+    finally:
+        if scaler is not None:
+            scaler.select_channels()
+            scaler.stage_sigs = old_sigs
 
-    if bec.peaks.aligned:
-        # again, tweak axis to maximize
-        md["purpose"] = "alignment - fine"
-        fwhm = bec.peaks["fwhm"][counter.name]
-        yield from bp.rel_scan([counter], axis, -fwhm, fwhm, npts, md=md)
-        yield from peak_analysis()
-
-    if scaler is not None:
-        scaler.select_channels()
-        scaler.stage_sigs = old_sigs
+    if result["aligned"]:
+        alignment_cache.put(
+            axis, counter, result["center"], result["fwhm"], energy, sample)
+    return result
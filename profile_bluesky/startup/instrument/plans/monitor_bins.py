@@ -0,0 +1,164 @@
+
+"""
+monitor signals during a run, recording time-binned statistics
+
+Instead of one event per monitor update (``monitor_during``),
+each signal's updates are collected into fixed time bins and
+written as one event (arrays of mean, min, max, count per bin)
+in the ``monitor_bins`` stream, just before the run closes.
+"""
+
+__all__ = """
+    monitor_binned_decorator
+    monitor_binned_wrapper
+    MonitorBins
+""".split()
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+from bluesky.utils import make_decorator
+import numpy as np
+from ophyd import Signal
+import threading
+import time
+
+
+class MonitorBins:
+    """
+    collect updates of signals into fixed time bins
+
+    PARAMETERS
+
+    signals : [ophyd.Signal]
+        signals to monitor (numerical values)
+    bin_s : float
+        width of each time bin (s)
+    stream : str
+        name of the event stream (default: ``monitor_bins``)
+    """
+
+    def __init__(self, signals, bin_s, stream="monitor_bins"):
+        self.signals = list(signals)
+        self.bin_s = bin_s
+        self.stream = stream
+        self._lock = threading.Lock()
+        self._cids = []
+        self._bins = [{} for _ in self.signals]   # bin index: [sum, min, max, count]
+        self.t0 = None
+
+    def start(self):
+        """start collecting (not a plan)"""
+        self.t0 = time.time()
+        self._bins = [{} for _ in self.signals]
+        for i, signal in enumerate(self.signals):
+            cid = signal.subscribe(self._make_callback(i))
+            self._cids.append((signal, cid))
+
+    def stop(self):
+        """stop collecting (not a plan)"""
+        for signal, cid in self._cids:
+            signal.unsubscribe(cid)
+        self._cids = []
+
+    def _make_callback(self, i):
+        def cb(value=None, timestamp=None, **kwargs):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return
+            k = int(((timestamp or time.time()) - self.t0) // self.bin_s)
+            with self._lock:
+                b = self._bins[i].get(k)
+                if b is None:
+                    self._bins[i][k] = [value, value, value, 1]
+                else:
+                    b[0] += value
+                    b[1] = min(b[1], value)
+                    b[2] = max(b[2], value)
+                    b[3] += 1
+        return cb
+
+    def summary_signals(self):
+        """soft signals holding the bin arrays (empty bins: NaN)"""
+        with self._lock:
+            keys = sorted({k for bins in self._bins for k in bins})
+            signals = [
+                Signal(
+                    name=f"{self.stream}_time",
+                    value=np.array([self.t0 + k * self.bin_s for k in keys])),
+            ]
+            for signal, bins in zip(self.signals, self._bins):
+                stats = np.full((4, len(keys)), np.nan)
+                for j, k in enumerate(keys):
+                    if k in bins:
+                        total, lo, hi, n = bins[k]
+                        stats[:, j] = (total / n, lo, hi, n)
+                stats[3][np.isnan(stats[3])] = 0
+                for row, suffix in enumerate("mean min max count".split()):
+                    signals.append(
+                        Signal(name=f"{signal.name}_{suffix}", value=stats[row]))
+        return signals
+
+    def write_event(self):
+        """plan: write the bins as one event in ``stream``"""
+        yield from bps.create(name=self.stream)
+        for signal in self.summary_signals():
+            yield from bps.read(signal)
+        yield from bps.save()
+
+
+def monitor_binned_wrapper(plan, signals, bin_s=1.0, stream="monitor_bins"):
+    """
+    monitor signals during the run, write time-binned statistics
+
+    The statistics (mean, min, max, count) of each signal
+    in each ``bin_s`` interval are written as one event in
+    the ``stream`` stream, just before the run closes.
+
+    PARAMETERS
+
+    plan : iterable or generator
+        a plan (with one run)
+    signals : [ophyd.Signal]
+        signals to monitor
+    bin_s : float
+        width of each time bin (s), default: 1
+    stream : str
+        name of the event stream (default: ``monitor_bins``)
+
+    EXAMPLE::
+
+        RE(monitor_binned_wrapper(bp.count([det], 100), [pind1, T_A], bin_s=10))
+    """
+    bins = MonitorBins(signals, bin_s, stream=stream)
+    state = dict(written=False)
+
+    def insert(msg):
+        if msg.command == "open_run":
+            def open_and_start():
+                ret = yield msg
+                bins.start()
+                return ret
+            return open_and_start(), None
+        elif msg.command == "close_run" and not state["written"]:
+            state["written"] = True
+
+            def write_and_close():
+                bins.stop()
+                yield from bins.write_event()
+                return (yield msg)
+            return write_and_close(), None
+        return None, None
+
+    def cleanup():
+        bins.stop()
+        yield from bps.null()
+
+    return (yield from bpp.finalize_wrapper(
+        bpp.plan_mutator(plan, insert), cleanup()))
+
+
+monitor_binned_decorator = make_decorator(monitor_binned_wrapper)
@@ -0,0 +1,162 @@
+
+"""
+fit a peak (Gaussian or Lorentzian) to scan data, with uncertainties
+"""
+
+__all__ = """
+    fit_peak
+    peak_found
+    peak_model
+""".split()
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+import numpy as np
+
+
+FWHM_PER_WIDTH = dict(
+    gaussian=2 * np.sqrt(2 * np.log(2)),    # width is sigma
+    lorentzian=2.0,                         # width is HWHM
+)
+
+
+def peak_model(x, height, center, width, background, shape="gaussian"):
+    """peak profile at positions ``x`` (array)"""
+    u = (np.asarray(x, dtype=float) - center) / width
+    if shape == "lorentzian":
+        profile = 1 / (1 + u**2)
+    else:
+        profile = np.exp(-0.5 * u**2)
+    return background + height * profile
+
+
+def _jacobian(x, p, shape):
+    """d(model)/d(parameter), one column per parameter"""
+    height, center, width, background = p
+    u = (x - center) / width
+    if shape == "lorentzian":
+        profile = 1 / (1 + u**2)
+        d_u = -2 * u * profile**2       # d(profile)/du
+    else:
+        profile = np.exp(-0.5 * u**2)
+        d_u = -u * profile
+    return np.column_stack((
+        profile,
+        -height * d_u / width,
+        -height * d_u * u / width,
+        np.ones_like(x),
+    ))
+
+
+def _initial_guess(x, y):
+    i = int(np.argmax(y))
+    background = float(np.min(y))
+    height = float(y[i]) - background
+    above = x[y >= background + height / 2]
+    fwhm = float(np.ptp(above)) if len(above) > 1 else float(np.ptp(x)) / 4
+    fwhm = fwhm or float(np.ptp(x)) / 4 or 1
+    return np.array([height, float(x[i]), fwhm / 2.3548, background])
+
+
+def fit_peak(x, y, shape="gaussian", weights=None, max_iterations=50):
+    """
+    least-squares fit of a peak to (x, y), Levenberg-Marquardt
+
+    ``weights`` default to Poisson statistics (1/sqrt(y)).
+
+    Returns a dictionary: ``center``, ``fwhm``, ``height``,
+    ``background``, ``center_err``, ``fwhm_err``, ``chisqr``
+    (reduced), ``shape``, or ``None`` if the fit fails.
+
+    EXAMPLE::
+
+        result = fit_peak(positions, counts)
+        print(f"{result['center']} +/- {result['center_err']}")
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n < 5 or np.ptp(y) == 0:
+        return None
+    if weights is None:
+        weights = 1 / np.sqrt(np.maximum(np.abs(y), 1))
+    w = np.asarray(weights, dtype=float)
+
+    p = _initial_guess(x, y)
+    lam = 1e-3
+
+    def chi2(p):
+        return float(np.sum((w * (y - peak_model(x, *p, shape=shape)))**2))
+
+    c2 = chi2(p)
+    for _ in range(max_iterations):
+        J = _jacobian(x, p, shape) * w[:, None]
+        r = w * (y - peak_model(x, *p, shape=shape))
+        A = J.T @ J
+        g = J.T @ r
+        try:
+            step = np.linalg.solve(A + lam * np.diag(np.diag(A)), g)
+        except np.linalg.LinAlgError:
+            return None
+        trial = p + step
+        trial[2] = abs(trial[2]) or p[2]
+        c2_trial = chi2(trial)
+        if c2_trial < c2:
+            converged = (c2 - c2_trial) < 1e-9 * max(c2, 1e-30)
+            p, c2, lam = trial, c2_trial, lam / 10
+            if converged:
+                break
+        else:
+            lam *= 10
+            if lam > 1e10:
+                break
+
+    J = _jacobian(x, p, shape) * w[:, None]
+    try:
+        covariance = np.linalg.inv(J.T @ J)
+    except np.linalg.LinAlgError:
+        return None
+    reduced = c2 / max(n - 4, 1)
+    errors = np.sqrt(np.abs(np.diag(covariance)) * max(reduced, 1e-30))
+    if not np.all(np.isfinite(p)) or not np.all(np.isfinite(errors)):
+        return None
+
+    factor = FWHM_PER_WIDTH.get(shape, FWHM_PER_WIDTH["gaussian"])
+    height, center, width, background = p
+    return dict(
+        shape=shape,
+        height=float(height),
+        center=float(center),
+        fwhm=float(factor * abs(width)),
+        background=float(background),
+        center_err=float(errors[1]),
+        fwhm_err=float(factor * errors[2]),
+        chisqr=float(reduced),
+    )
+
+
+def peak_found(result, x, y, peak_factor=4, width_factor=0.8):
+    """
+    True if the fit ``result`` (from ``fit_peak()``) of (x, y) is a clear peak
+
+    * maximum must be greater than ``peak_factor`` * minimum
+    * fwhm must be less than ``width_factor`` * range of x
+    * center must be within the range of x
+
+    Logs the reason if not.
+    """
+    if result is None:
+        logger.error("no peak could be fitted")
+        return False
+    hi, lo = max(y), min(y)
+    x_range = max(x) - min(x)
+    if hi < peak_factor*lo:
+        logger.error(f"no clear peak: {hi} < {peak_factor}*{lo}")
+    elif result["fwhm"] > width_factor*x_range:
+        logger.error(f"FWHM too large: {result['fwhm']} > {width_factor}*{x_range}")
+    elif not (min(x) <= result["center"] <= max(x)):
+        logger.error(f"center {result['center']} outside of scan range")
+    else:
+        return True
+    return False
@@ -11,16 +11,22 @@ from instrument.session_logs import logger
 logger.info(__file__)
 
 from ..devices import aps, detu, I0Mon, soft_glue
-from ..devices import aps, dm_pars, dm_workflow
+from ..devices import aps, dm_pars, dm_workflow, RegisterSnapshot
 from ..devices import Atten1, Atten2, scaler1
+from ..devices import exposed_spots, samplestage
 from ..devices import timebase, pind1, pind2, T_A, T_SET
-from ..framework import db, RE
+from ..framework import run_context
+from ..utils.phase_timing import acquisition_timing
+from .functions import read_concurrently
+from .monitor_bins import monitor_binned_decorator
 from bluesky import plan_stubs as bps
 from bluesky import preprocessors as bpp
 import apstools.utils
+import copy
 import datetime
 import ophyd.signal
 import os
+import time
 
 
 def AD_Acquire(areadet,
@@ -31,7 +37,10 @@ def AD_Acquire(areadet,
                path=None,
                submit_xpcs_job=True,
                atten=0,
-               md={}):
+               md={},
+               post_processing=None,
+               points=None,
+               monitor_bin_s=None):
     """
     acquisition sequence initiating data management workflow
 
@@ -45,6 +54,33 @@ def AD_Acquire(areadet,
       scalers and devices such as temperature
     * trigger area detector while monitoring the
       above params
+    * write the HDF5 workflow file, verify the files,
+      and start the DM workflow
+
+    If ``post_processing`` (a ``PostRunPipeline``) is given, the last
+    step runs in its background thread (using a snapshot of the
+    metadata registers) so the next acquisition can start at once.
+
+    If ``points`` (a list of plans, or functions returning a plan,
+    such as sample moves or temperature changes) is given, a block of
+    ``num_images`` frames is acquired after each one, all into one
+    IMM file (one datum per block) with one staging, one DM workflow.
+    The detector must have ``supports_multi_point``.
+
+    If ``monitor_bin_s`` is given, the monitored signals are recorded
+    as time-binned statistics (mean, min, max, count per bin of
+    ``monitor_bin_s`` seconds) in one ``monitor_bins`` event, instead
+    of one event per update.
+
+    Returns a dictionary with the run's ``uid`` and ``acquire_s``,
+    the time (s) spent acquiring.
+
+    EXAMPLE::
+
+        xs = [-0.2, 0, 0.2]
+        RE(AD_Acquire(lambdadet, "A001", 0.01, 0.01, 1000,
+            path="/home/8-id-i/2020-3/test202008",
+            points=[bps.mv(samplestage.x, x) for x in xs]))
     """
     logger.info("AD_Acquire starting")
 
@@ -53,6 +89,13 @@ def AD_Acquire(areadet,
         raise ValueError("path is not specified."
             "  Typical value: /home/8ididata/2020-3/test202008")
 
+    if points is not None:
+        if not getattr(areadet, "supports_multi_point", False):
+            raise ValueError(f"{areadet.name} does not support points")
+        num_points = len(points)
+    else:
+        num_points = 1
+
     file_name = dm_workflow.cleanupFilename(file_name)
     file_path = os.path.join(path,file_name)
     if not file_path.endswith(os.path.sep):
@@ -67,6 +110,8 @@ def AD_Acquire(areadet,
         file_name = file_name,
         submit_xpcs_job = str(submit_xpcs_job),
     )
+    if points is not None:
+        plan_args["num_points"] = num_points
     if atten is not None:
         plan_args["atten"] = atten
     if path is not None:
@@ -77,17 +122,28 @@ def AD_Acquire(areadet,
     atten = atten or Atten1
     assert atten in (Atten1, Atten2)
 
+    # time spent in each phase, see: acquisition_timing_report()
+    timing = acquisition_timing.new_record(label=file_name)
+
     # select the detector's number
-    yield from bps.mv(dm_pars.detNum, areadet.detector_number)
+    yield from timing.timed(
+        "detNum", bps.mv(dm_pars.detNum, areadet.detector_number))
 
-    yield from areadet.cam.setup_modes(num_images)
-    yield from areadet.cam.setTime(acquire_time, acquire_period)
+    yield from timing.timed(
+        "setup_modes", areadet.cam.setup_modes(num_images))
+    yield from timing.timed(
+        "setTime", areadet.cam.setTime(acquire_time, acquire_period))
 
     # Ask the devices to configure themselves for this plan.
     # no need to yield here, method does not have "yield from " calls
     scaler1.staging_setup_DM(acquire_period)
-    areadet.staging_setup_DM(file_path, file_name,
-            num_images, acquire_time, acquire_period)
+    if points is None:
+        areadet.staging_setup_DM(file_path, file_name,
+                num_images, acquire_time, acquire_period)
+    else:
+        areadet.staging_setup_DM(file_path, file_name,
+                num_images, acquire_time, acquire_period,
+                num_points=num_points)
     dm_workflow.set_xpcs_qmap_file(areadet.qmap_file)
 
     scaler1.select_channels(None)
@@ -100,6 +156,10 @@ def AD_Acquire(areadet,
         T_A,
         T_SET,
     ]
+    progress = getattr(areadet, "progress", None)
+    if progress is not None:
+        # secondary streams: frame rates, ETA, dropped frames
+        monitored_things += progress.monitored_signals
     """
         #Timebase,
         pind1,
@@ -119,7 +179,7 @@ def AD_Acquire(areadet,
     def timestamp_now():
         return datetime.datetime.now().strftime("%c").strip()
 
-    def make_hdf5_workflow_filename():
+    def make_hdf5_workflow_filename(registers):
         path = file_path
         if path.startswith("/data"):
             path = os.path.join("/", "home", "8ididata", *path.split("/")[2:])
@@ -129,8 +189,8 @@ def AD_Acquire(areadet,
                 logger.debug(f"created path: {path}")
         fname = (
             f"{file_name}"
-            f"_{dm_pars.data_begin.get():04.0f}"
-            f"-{dm_pars.data_end.get():04.0f}"
+            f"_{registers.data_begin.get():04.0f}"
+            f"-{registers.data_end.get():04.0f}"
         )
         fullname = os.path.join(path, f"{fname}.hdf")
         suffix = 0
@@ -145,31 +205,28 @@ def AD_Acquire(areadet,
         detNum = int(dm_pars.detNum.get())
         det_pars = dm_workflow.detectors.getDetectorByNumber(detNum)
         logger.info(f"detNum={detNum}, det_pars={det_pars}")
-        yield from bps.mv(
-            # StrReg 2-7 in order
-            dm_pars.root_folder, file_path,
-        )
-        # logger.debug("dm_pars.root_folder")
 
-        yield from bps.mv(
-            dm_pars.user_data_folder, os.path.dirname(file_path),   # just last item in path
+        # snapshot: read all source values at once
+        source = read_concurrently(
+            current=aps.current.get,
+            attenuation=atten.get,
+            stage_x=lambda: detu.x.position,
+            stage_z=lambda: detu.z.position,
+            I0mon=I0Mon.get,
         )
-        # logger.debug("dm_pars.user_data_folder")
+        for k, v in source.items():
+            if k != "I0mon" and isinstance(v, Exception):
+                raise v
 
-        yield from bps.mv(
+        registers = [
+            # StrReg 2-7
+            dm_pars.root_folder, file_path,
+            dm_pars.user_data_folder, os.path.dirname(file_path),   # just last item in path
             dm_pars.data_folder, file_name,
-        )
-        # logger.debug("dm_pars.data_folder")
-
-        yield from bps.mv(
             dm_pars.source_begin_datetime, timestamp_now(),
-        )
-        # logger.debug("dm_pars.source_begin_datetime")
-
-        yield from bps.mv(
             # Reg 121
-            dm_pars.source_begin_current, aps.current.get(),
-            # Reg 101-110 in order
+            dm_pars.source_begin_current, source["current"],
+            # Reg 101-110
             dm_pars.roi_x1, 0,
             dm_pars.roi_x2, det_pars["ccdHardwareColSize"]-1,
             dm_pars.roi_y1, 0,
@@ -179,51 +236,39 @@ def AD_Acquire(areadet,
             dm_pars.kinetics_state, 0,                  # FIXME: SPEC generated this
             dm_pars.kinetics_window_size, 0,            # FIXME:
             dm_pars.kinetics_top, 0,                    # FIXME:
-            dm_pars.attenuation, atten.get(),
-        )
-        # logger.debug("Reg 121, 101-110 done")
-
-        yield from bps.mv(
-            # Reg 111-120 in order
+            dm_pars.attenuation, source["attenuation"],
+            # Reg 111-120
             #dm_pars.dark_begin, -1,            #  edit if detector needs this
             #dm_pars.dark_end, -1,              #  op cit
             dm_pars.data_begin, 1,
-            dm_pars.data_end, num_images,
+            dm_pars.data_end, num_images * num_points,
             dm_pars.exposure_time, acquire_time,
             dm_pars.exposure_period, acquire_period,
             # dm_pars.specscan_dark_number, -1,   #  not used, detector takes no darks
-            dm_pars.stage_x, detu.x.position,
-            dm_pars.stage_z, detu.z.position,
-        )
-        # logger.debug("Reg 111-120 done")
-
-        # yield from bps.mv(
-        #     # Reg 123-127 in order
-        #     dm_pars.I0mon, I0Mon.get(),
-        #     dm_pars.burst_mode_state, 0,   # 0 for Lambda, other detector might use this
-        #     dm_pars.number_of_bursts, 0,   # 0 for Lambda, other detector might use this
-        #     dm_pars.first_usable_burst, 0,   # 0 for Lambda, other detector might use this
-        #     dm_pars.last_usable_burst, 0,   # 0 for Lambda, other detector might use this
-        # )
-        # # logger.debug("Reg 123-127 done")
-
-        try:
-            yield from bps.mv(
-                # Reg 123-127 in order
-                dm_pars.I0mon, I0Mon.get(),
+            dm_pars.stage_x, source["stage_x"],
+            dm_pars.stage_z, source["stage_z"],
+        ]
+        if isinstance(source["I0mon"], ophyd.signal.ReadTimeoutError):
+            logger.warn("EPICS ReadTimeoutError from scaler (ignoring): %s", str(source["I0mon"]))
+        elif isinstance(source["I0mon"], Exception):
+            raise source["I0mon"]
+        else:
+            registers += [
+                # Reg 123-127
+                dm_pars.I0mon, source["I0mon"],
                 dm_pars.burst_mode_state, 0,   # 0 for Lambda, other detector might use this
                 dm_pars.number_of_bursts, 0,   # 0 for Lambda, other detector might use this
                 dm_pars.first_usable_burst, 0,   # 0 for Lambda, other detector might use this
                 dm_pars.last_usable_burst, 0,   # 0 for Lambda, other detector might use this
-            )
-        except ophyd.signal.ReadTimeoutError as exc:
-            logger.warn("EPICS ReadTimeoutError from scaler (ignoring): %s", str(exc))
+            ]
 
+        # write all registers in parallel, one wait
+        yield from bps.mv(*registers)
 
     def update_metadata_postscan():
-        # since we inherited ALL the user's namespace, we have RE and db
-        scan_id = RE.md["scan_id"]
-        uid = db[-1].start["uid"]
+        # facts recorded when the run was opened, no database query
+        scan_id = run_context["scan_id"]
+        uid = run_context["uid"]
         yield from bps.mv(
             # source end values
             dm_pars.source_end_datetime, timestamp_now(),
@@ -232,40 +277,92 @@ def AD_Acquire(areadet,
             dm_pars.scan_id, int(scan_id),
             dm_pars.datafilename, areadet.plugin_file_name,
         )
+        if getattr(areadet, "discovers_frame_count", False):
+            # frames actually written
+            yield from bps.mv(dm_pars.data_end, areadet.images_received)
         # logger.debug("dm_pars.datafilename")
+        return uid
+
+    def record_exposed_spot():
+        """add this exposure to the dose index of the sample spots"""
+        try:
+            dose = exposed_spots.record(
+                samplestage.x.position,
+                samplestage.z.position,
+                exposure_s=acquire_time * num_images,
+                transmission=atten.get(),
+                uid=run_context["uid"],
+                file_name=file_name,
+            )
+            logger.debug("exposed spot dose: %g", dose)
+        except Exception as exc:
+            logger.warning("could not record the exposed spot: %s", exc)
+
+    def record_phase_times(stream):
+        """plan: one event with the time (s) of each phase so far"""
+        signals = [
+            ophyd.signal.Signal(name=f"phase_{phase}", value=seconds)
+            for phase, seconds in sorted(timing.phases.items())
+        ]
+        yield from bps.create(stream)
+        for signal in signals:
+            yield from bps.read(signal)
+        yield from bps.save()
 
     def inner_count(devices, md={}):
-        yield from bps.open_run(md=md)
+        yield from run_context.open_run(
+            md=md, file_name=file_name, file_path=file_path)
+        t0 = time.time()
         for obj in devices:
             yield from bps.stage(obj)
-        grp = bps._short_uid('trigger')
-        no_wait = True
-        for obj in devices:
-            if hasattr(obj, 'trigger'):
-                no_wait = False
-                yield from bps.trigger(obj, group=grp)
-        if areadet.cam.EXT_TRIGGER > 0:
-            yield from soft_glue.start_trigger()
-        # Skip 'wait' if none of the devices implemented a trigger method.
-        if not no_wait:
-            yield from bps.wait(group=grp)
-        yield from bps.create('primary')
-        # ret = {}  # collect and return readings to give plan access to them
-        for obj in devices:
-            reading = (yield from bps.read(obj))
-            # if reading is not None:
-            #     ret.update(reading)
-        yield from bps.save()
+        timing.add("stage", time.time() - t0)
+        # one frame block (one event) per point, the file stays open
+        for point in (points or [None]):
+            if point is not None:
+                yield from timing.timed(
+                    "move", point() if callable(point) else point)
+            grp = bps._short_uid('trigger')
+            no_wait = True
+            t0 = time.time()
+            for obj in devices:
+                if hasattr(obj, 'trigger'):
+                    no_wait = False
+                    yield from bps.trigger(obj, group=grp)
+            if areadet.cam.EXT_TRIGGER > 0 and not getattr(
+                    areadet, "arms_frame_triggers", False):
+                yield from soft_glue.start_trigger()
+            timing.add("trigger", time.time() - t0)
+            # Skip 'wait' if none of the devices implemented a trigger method.
+            t0 = time.time()
+            if not no_wait:
+                yield from bps.wait(group=grp)
+            timing.add("readout", time.time() - t0)
+            record_exposed_spot()
+            yield from bps.create('primary')
+            # ret = {}  # collect and return readings to give plan access to them
+            for obj in devices:
+                reading = (yield from bps.read(obj))
+                # if reading is not None:
+                #     ret.update(reading)
+            yield from bps.save()
         for obj in devices:
             yield from bps.unstage(obj)
+        # the stop document has no room for metadata: use a stream
+        yield from record_phase_times("phase_times")
         yield from bps.close_run()
         # return ret
 
+    if monitor_bin_s is None:
+        monitor_decorator = bpp.monitor_during_decorator(monitored_things)
+    else:
+        monitor_decorator = monitor_binned_decorator(
+            monitored_things, bin_s=monitor_bin_s)
+
     @bpp.stage_decorator([scaler1])
-    @bpp.monitor_during_decorator(monitored_things)
+    @monitor_decorator
     def full_acquire_procedure(md={}):
         logger.debug("before update_metadata_prescan()")
-        yield from update_metadata_prescan()
+        yield from timing.timed("prescan", update_metadata_prescan())
         logger.debug("after update_metadata_prescan()")
 
         logger.debug("supplied metadata = %s", md)
@@ -276,6 +373,7 @@ def AD_Acquire(areadet,
             "file_path": file_path
         }
         _md.update(md)
+        _md["phase_times"] = dict(timing.phases)     # before the run
         logger.debug("metadata = %s", _md)
         # start autocount on the scaler
         yield from bps.mv(scaler1.count, "Count")
@@ -284,32 +382,88 @@ def AD_Acquire(areadet,
         # do the acquisition (the scan)
         logger.debug("before count()")
         # yield from bp.count([areadet], md=md)
+        t0 = time.time()
         yield from inner_count([areadet], md=_md)
+        acquire_s = time.time() - t0
         logger.debug("after count()")
 
-        yield from update_metadata_postscan()
-        hdf_with_fullpath = make_hdf5_workflow_filename()
-        print(f"HDF5 workflow file name: {hdf_with_fullpath}")
-
-        if not os.path.exists(os.path.dirname(hdf_with_fullpath)):
-            os.makedirs(os.path.dirname(hdf_with_fullpath))
-
-        dm_workflow.create_hdf5_file(hdf_with_fullpath)
+        uid = yield from timing.timed("postscan", update_metadata_postscan())
 
         # update these str values from the string registers
         dm_workflow.transfer = dm_pars.transfer.get()
         dm_workflow.analysis = dm_pars.analysis.get()
 
-        # no need to yield from since the function is not a plan
-        kickoff_DM_workflow(hdf_with_fullpath, analysis=submit_xpcs_job)
+        if post_processing is None:
+            post_run_processing(dm_pars, dm_workflow, uid, threaded_kickoff=True)
+        else:
+            # registers will change for the next acquisition: use a copy
+            registers = RegisterSnapshot(dm_pars)
+            workflow = copy.copy(dm_workflow)
+            workflow.registers = registers
+            post_processing.submit(
+                post_run_processing, registers, workflow, uid,
+                label=file_name)
+        return dict(uid=uid, acquire_s=acquire_s)
+
+    def post_run_processing(registers, workflow, uid, threaded_kickoff=False):
+        """write the HDF5 workflow file, verify, start the DM workflow"""
+        with timing.span("hdf5"):
+            hdf_with_fullpath = make_hdf5_workflow_filename(registers)
+            print(f"HDF5 workflow file name: {hdf_with_fullpath}")
+
+            if not os.path.exists(os.path.dirname(hdf_with_fullpath)):
+                os.makedirs(os.path.dirname(hdf_with_fullpath))
+
+            workflow.create_hdf5_file(hdf_with_fullpath)
+
+        with timing.span("verify"):
+            problems = verify_files(registers, hdf_with_fullpath)
+        if len(problems) > 0:
+            logger.error(
+                "DM workflow not started for %s: %s",
+                hdf_with_fullpath, "; ".join(problems))
+            timing.save(uid=uid)
+            return
+
+        def kickoff():
+            try:
+                with timing.span("dm_kickoff"):
+                    kickoff_DM_workflow(
+                        workflow, hdf_with_fullpath, analysis=submit_xpcs_job)
+            finally:
+                timing.save(uid=uid)
 
-    @apstools.utils.run_in_thread
-    def kickoff_DM_workflow(hdf_workflow_file, analysis=True):
+        # no need to yield from since the function is not a plan
+        if threaded_kickoff:
+            apstools.utils.run_in_thread(kickoff)()
+        else:
+            kickoff()
+
+    def verify_files(registers, hdf_workflow_file):
+        """
+        list of problems with the run's files (empty if none)
+
+        The HDF5 workflow file must exist and not be empty.
+        The data file is checked only if its directory is visible here.
+        """
+        problems = []
+        if not os.path.isfile(hdf_workflow_file):
+            problems.append(f"no HDF5 workflow file {hdf_workflow_file}")
+        elif os.path.getsize(hdf_workflow_file) == 0:
+            problems.append(f"empty HDF5 workflow file {hdf_workflow_file}")
+        data_file = os.path.join(file_path, str(registers.datafilename.get()))
+        if not os.path.isdir(file_path):
+            logger.debug("data directory not visible here: %s", file_path)
+        elif not os.path.isfile(data_file):
+            problems.append(f"no data file {data_file}")
+        return problems
+
+    def kickoff_DM_workflow(workflow, hdf_workflow_file, analysis=True):
         logger.info(f"DM workflow kickoff starting: analysis:{analysis}  file:{hdf_workflow_file}")
         if analysis:
-            out, err = dm_workflow.DataAnalysis(hdf_workflow_file)
+            out, err = workflow.DataAnalysis(hdf_workflow_file)
         else:
-            out, err = dm_workflow.DataTransfer(hdf_workflow_file)
+            out, err = workflow.DataTransfer(hdf_workflow_file)
         logger.info("DM workflow kickoff done")
         logger.info(out)
         if len(err) > 0:
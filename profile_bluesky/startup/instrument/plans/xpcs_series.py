@@ -0,0 +1,198 @@
+"""
+Acquire a series of XPCS measurements, overlapping post-run processing
+
+The post-run phase of each acquisition (HDF5 workflow file,
+file verification, DM workflow submission) runs in a background pipeline while
+the next acquisition is set up and acquired.
+"""
+
+__all__ = """
+    AD_Acquire_series
+    PostRunPipeline
+""".split()
+
+from instrument.session_logs import logger
+logger.info(__file__)
+
+from ..devices import T_SET
+from .xpcs_acquire import AD_Acquire
+from bluesky import plan_stubs as bps
+from concurrent.futures import ThreadPoolExecutor
+import pyRestTable
+import time
+
+
+class PostRunPipeline:
+    """
+    run post-run jobs in order, in a background thread
+
+    At most ``depth`` jobs may be waiting or running.
+    Plans call ``wait_for_slot()`` (a plan) before the next
+    acquisition so acquisitions cannot run away from the
+    post-processing.
+
+    PARAMETERS
+
+    depth : int
+        maximum number of jobs waiting or running (default: 2)
+
+    USAGE::
+
+        pipeline = PostRunPipeline(depth=2)
+        yield from AD_Acquire(..., post_processing=pipeline)
+        yield from pipeline.wait_for_slot()
+        yield from AD_Acquire(..., post_processing=pipeline)
+        yield from pipeline.drain()
+    """
+
+    poll_s = 0.05
+
+    def __init__(self, depth=2):
+        self.depth = max(1, depth)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._futures = []
+        self.job_times = []     # (label, seconds) of finished jobs
+
+    @property
+    def pending(self):
+        """number of jobs waiting or running"""
+        self._futures = [f for f in self._futures if not f.done()]
+        return len(self._futures)
+
+    def submit(self, func, *args, label=None, **kwargs):
+        """queue ``func(*args, **kwargs)`` (not a plan)"""
+
+        def job():
+            t0 = time.time()
+            try:
+                func(*args, **kwargs)
+            except Exception as exc:
+                logger.exception("post-run job %s failed: %s", label, exc)
+            finally:
+                self.job_times.append((label, time.time() - t0))
+
+        self._futures.append(self._executor.submit(job))
+
+    def wait_for_slot(self):
+        """plan: wait until fewer than ``depth`` jobs are pending"""
+        while self.pending >= self.depth:
+            yield from bps.sleep(self.poll_s)
+
+    def drain(self):
+        """plan: wait until all jobs are finished"""
+        while self.pending > 0:
+            yield from bps.sleep(self.poll_s)
+
+
+def AD_Acquire_series(areadet,
+                      file_name,
+                      acquire_time,
+                      acquire_period,
+                      num_images,
+                      path=None,
+                      samples=None,
+                      temperatures=None,
+                      repeats=1,
+                      set_temperature=None,
+                      depth=2,
+                      submit_xpcs_job=True,
+                      atten=0,
+                      monitor_bin_s=None,
+                      md={}):
+    """
+    XPCS acquisitions: samples x temperatures x repeats, pipelined
+
+    The post-run phase of acquisition N runs in a ``PostRunPipeline``
+    (bounded by ``depth``) while acquisition N+1 is set up and acquired.
+    Reports the duty cycle: time spent acquiring, as a fraction of the
+    time until the last acquisition was done (post-processing of the
+    last acquisition, after that, is not counted).
+
+    PARAMETERS
+
+    areadet, acquire_time, acquire_period, num_images, path, submit_xpcs_job, atten, monitor_bin_s
+        as for ``AD_Acquire()``
+    file_name : str
+        base of the file names, a sequence number is appended
+        (such as ``A001_0001``, ``A001_0002``, ...)
+    samples : [function]
+        functions returning a plan that moves to each sample (called
+        again at each temperature), such as ``[samplestage.movesample] * 5``
+        (default: current sample)
+    temperatures : [float]
+        temperature set points (default: current temperature)
+    repeats : int
+        acquisitions at each sample & temperature (default: 1)
+    set_temperature : function
+        ``set_temperature(T)`` returns a plan that changes the
+        temperature (default: set ``T_SET``)
+    depth : int
+        maximum post-run jobs pending (default: 2)
+
+    Returns list of run ``uid``.
+
+    EXAMPLE::
+
+        RE(AD_Acquire_series(
+            lambdadet, "A001", 0.01, 0.01, 1000,
+            path="/home/8-id-i/2020-3/test202008",
+            samples=[samplestage.movesample]*10,
+            temperatures=[25, 30, 35],
+            repeats=2))
+    """
+    samples = samples or [None]
+    for sample in samples:
+        if sample is not None and not callable(sample):
+            # a plan (generator) could be used only once
+            raise TypeError(
+                f"samples must be functions returning a plan, received {sample!r}")
+    temperatures = temperatures or [None]
+    set_temperature = set_temperature or (lambda t: bps.mv(T_SET, t))
+    pipeline = PostRunPipeline(depth=depth)
+
+    uids = []
+    acquire_s = 0
+    t0 = time.time()
+    for temperature in temperatures:
+        if temperature is not None:
+            logger.info("series: temperature %s", temperature)
+            yield from set_temperature(temperature)
+        for sample in samples:
+            if sample is not None:
+                yield from sample()
+            for _r in range(repeats):
+                yield from pipeline.wait_for_slot()
+                _md = dict(md)
+                _md.update(dict(
+                    series_index=len(uids),
+                    series_temperature=temperature,
+                ))
+                result = yield from AD_Acquire(
+                    areadet,
+                    f"{file_name}_{len(uids)+1:04d}",
+                    acquire_time,
+                    acquire_period,
+                    num_images,
+                    path=path,
+                    submit_xpcs_job=submit_xpcs_job,
+                    atten=atten,
+                    md=_md,
+                    post_processing=pipeline,
+                    monitor_bin_s=monitor_bin_s,
+                )
+                uids.append(result["uid"])
+                acquire_s += result["acquire_s"]
+    t_setup = time.time() - t0
+    yield from pipeline.drain()
+    total = time.time() - t0
+
+    tbl = pyRestTable.Table()
+    tbl.labels = ("term", "value")
+    tbl.addRow(("acquisitions", len(uids)))
+    tbl.addRow(("acquiring, s", f"{acquire_s:.3f}"))
+    tbl.addRow(("until last acquisition done, s", f"{t_setup:.3f}"))
+    tbl.addRow(("total (with post-processing), s", f"{total:.3f}"))
+    tbl.addRow(("post-run jobs, s", f"{sum(t for _, t in pipeline.job_times):.3f}"))
+    tbl.addRow(("duty cycle", f"{acquire_s/max(t_setup, 1e-9):.3f}"))
+    logger.info("AD_Acquire_series summary:\n%s", tbl)
+    return uids
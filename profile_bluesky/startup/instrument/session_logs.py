@@ -2,11 +2,15 @@
 configure session logging
 """
 
-__all__ = ['logger', ]
+__all__ = ['logger', 'set_log_level', 'set_log_rate_limit']
 
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import stdlogpj
+import threading
 
 _log_path = os.path.join(os.getcwd(), ".logs")
 if not os.path.exists(_log_path):
@@ -31,6 +35,130 @@ logger = stdlogpj.standard_logging_setup(
     backupCount=30)
 logger.setLevel(logging.DEBUG)
 
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    put the record on the queue without formatting it
+
+    Formatting is done by the QueueListener's handler (not by the caller).
+    Safe since the queue is in-process.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SubsystemFilter(logging.Filter):
+    """
+    per-subsystem levels and rate limits
+
+    A *subsystem* is the module (file name without ``.py``)
+    that made the log record, such as ``lambda_750k``.
+
+    * records below the subsystem's level are dropped
+    * each logging call site (module & line) is limited
+      to ``rate_limit`` records per second (WARNING and above
+      are never limited); when a record passes again, a summary
+      record with the count of dropped records is logged first
+      (the count is also in the record's ``suppressed`` attribute)
+    """
+
+    def __init__(self, rate_limit=20):
+        super().__init__()
+        self.levels = {}            # subsystem: level
+        self.rate_limit = rate_limit
+        self._sites = {}            # (module, lineno): [window start, count, suppressed]
+        self._lock = threading.Lock()   # records come from many threads
+
+    def filter(self, record):
+        if record.levelno < self.levels.get(record.module, logging.NOTSET):
+            return False
+        if not self.rate_limit or record.levelno >= logging.WARNING:
+            return True
+        key = (record.module, record.lineno)
+        now = record.created
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= 1:
+                suppressed = 0 if site is None else site[2]
+                self._sites[key] = [now, 1, 0]
+            elif site[1] >= self.rate_limit:
+                site[2] += 1
+                return False
+            else:
+                site[1] += 1
+                return True
+        record.suppressed = suppressed
+        if suppressed > 0:
+            self._summarize(record, suppressed)
+        return True
+
+    @staticmethod
+    def _summarize(record, suppressed):
+        """log a summary of the records dropped at this call site"""
+        summary = logging.makeLogRecord(dict(
+            record.__dict__,
+            msg="%d similar messages suppressed",
+            args=(suppressed,),
+            exc_info=None,
+            exc_text=None,
+            stack_info=None,
+            suppressed=suppressed,
+        ))
+        # to the handlers directly: the filters already passed this site
+        logging.getLogger(record.name).callHandlers(summary)
+
+
+def _level_number(level):
+    """logging level number of ``level`` (a number or a name such as "INFO")"""
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(str(level).upper())
+    if not isinstance(number, int):
+        raise ValueError(f"unknown logging level: {level!r}")
+    return number
+
+
+def set_log_level(subsystem, level):
+    """
+    set the logging level of one subsystem (module), such as
+
+        set_log_level("lambda_750k", "INFO")
+
+    Use ``level=None`` to restore the default.
+    """
+    if level is None:
+        _subsystem_filter.levels.pop(subsystem, None)
+    else:
+        _subsystem_filter.levels[subsystem] = _level_number(level)
+
+
+def set_log_rate_limit(records_per_second):
+    """maximum records/s from any one logging call (0 or None: no limit)"""
+    _subsystem_filter.rate_limit = records_per_second
+
+
+# Log records are queued by the caller (RunEngine, CA callback threads, ...)
+# and formatted & written by QueueListener threads.  Each original handler
+# gets its own queue, so logger.handlers[0] is still the console writer.
+_subsystem_filter = SubsystemFilter()
+logger.addFilter(_subsystem_filter)
+_log_listeners = []
+for _i, _handler in enumerate(list(logger.handlers)):
+    _queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(
+        _queue, _handler, respect_handler_level=True)
+    _listener.start()
+    _log_listeners.append(_listener)
+    logger.handlers[_i] = LazyQueueHandler(_queue)
+
+
+@atexit.register
+def _stop_log_listeners():
+    for listener in _log_listeners:
+        listener.stop()
+
+
 logger.info('#'*60 + " startup")
 logger.info('logging started')
 logger.info(f'logging level = {logger.level}')
@@ -1 +1,3 @@
 from .explorer import *
+from .phase_timing import *
+from .alignment_cache import *
@@ -0,0 +1,144 @@
+
+"""
+results of recent alignments, kept between sessions to warm-start scans
+"""
+
+__all__ = """
+    alignment_cache
+    alignment_cache_report
+""".split()
+
+from ..session_logs import logger
+logger.info(__file__)
+
+from bluesky.utils import PersistentDict
+import os
+import pyRestTable
+import re
+import threading
+import time
+
+
+class AlignmentCache:
+    """
+    persistent cache of fitted peaks, by (axis, counter, energy, sample)
+
+    Each entry: ``center``, ``fwhm``, ``time`` (and the key parts).
+    Energies are rounded to ``energy_resolution`` (keV) in the key.
+
+    PARAMETERS
+
+    path : str
+        directory of the store (a bluesky ``PersistentDict``)
+    energy_resolution : float
+        energies closer than this share an entry (default: 0.001 keV)
+    max_age_s : float
+        older entries are not used (default: 7 days)
+    """
+
+    def __init__(self, path, energy_resolution=0.001, max_age_s=7*24*3600):
+        self.path = path
+        self.energy_resolution = energy_resolution
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()
+        self._store = None
+
+    @property
+    def store(self):
+        """the PersistentDict, opened on first use"""
+        with self._lock:
+            if self._store is None:
+                os.makedirs(self.path, exist_ok=True)
+                self._store = PersistentDict(self.path)
+            return self._store
+
+    def key(self, axis, counter, energy=None, sample=None):
+        """store key (a safe file name) of these alignment conditions"""
+        if energy is not None:
+            energy = round(round(energy / self.energy_resolution) * self.energy_resolution, 6)
+        parts = [getattr(axis, "name", axis), getattr(counter, "name", counter), energy, sample or ""]
+        return re.sub(r"[^A-Za-z0-9_.+~-]", "_", "~".join(map(str, parts)))
+
+    def get(self, axis, counter, energy=None, sample=None, max_age_s=None):
+        """the cached entry (dict) or ``None`` if missing or too old"""
+        try:
+            entry = self.store.get(self.key(axis, counter, energy, sample))
+        except Exception as exc:
+            logger.warning("alignment cache not available: %s", exc)
+            return None
+        max_age_s = self.max_age_s if max_age_s is None else max_age_s
+        if entry is None or time.time() - entry["time"] > max_age_s:
+            return None
+        return dict(entry)
+
+    def put(self, axis, counter, center, fwhm, energy=None, sample=None):
+        """save the fitted peak of an alignment"""
+        entry = dict(
+            axis=getattr(axis, "name", str(axis)),
+            counter=getattr(counter, "name", str(counter)),
+            energy=energy,
+            sample=sample or "",
+            center=float(center),
+            fwhm=float(fwhm),
+            time=time.time(),
+        )
+        try:
+            self.store[self.key(axis, counter, energy, sample)] = entry
+        except Exception as exc:
+            logger.warning("could not save alignment result: %s", exc)
+
+    def clear(self):
+        """forget all entries"""
+        self.store.clear()
+
+    def report(self):
+        """table of all entries, most recent first"""
+        tbl = pyRestTable.Table()
+        tbl.labels = "axis counter energy sample center fwhm age(s)".split()
+        now = time.time()
+        entries = sorted(self.store.values(), key=lambda e: -e["time"])
+        for e in entries:
+            tbl.addRow([
+                e["axis"], e["counter"], e["energy"], e["sample"],
+                e["center"], e["fwhm"], round(now - e["time"]),
+            ])
+        print(f"alignment cache: {self.path}")
+        print(tbl)
+        return tbl
+
+
+def warm_range(entry, start, minus, plus, npts, widths=3, min_pts=7):
+    """
+    narrowed (minus, plus, npts) around a cached peak, or ``None``
+
+    The range is the cached center +/- ``widths`` * FWHM (relative to
+    ``start``), within the original range.  Points scale with the range.
+    ``None`` if the cached center is outside of the original range.
+    """
+    if entry is None:
+        return None
+    lo, hi = start + min(minus, plus), start + max(minus, plus)
+    center, fwhm = entry["center"], abs(entry["fwhm"])
+    if not (lo <= center <= hi) or fwhm <= 0:
+        return None
+    new_lo = max(lo, center - widths * fwhm)
+    new_hi = min(hi, center + widths * fwhm)
+    if new_hi - new_lo >= hi - lo:
+        return None
+    fraction = (new_hi - new_lo) / (hi - lo)
+    points = min(npts, max(min_pts, int(round(npts * fraction))))
+    return new_lo - start, new_hi - start, points
+
+
+alignment_cache = AlignmentCache(
+    os.path.join(
+        os.environ.get("HOME", os.getcwd()),
+        ".config",
+        "Bluesky_alignment_cache",
+    )
+)
+
+
+def alignment_cache_report():
+    """print the cached alignment results"""
+    return alignment_cache.report()
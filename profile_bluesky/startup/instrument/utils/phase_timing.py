@@ -0,0 +1,151 @@
+
+"""
+per-phase latency of acquisitions, kept in a local time-series store
+"""
+
+__all__ = """
+    acquisition_timing
+    acquisition_timing_report
+""".split()
+
+from ..session_logs import logger
+logger.info(__file__)
+
+import contextlib
+import json
+import numpy as np
+import os
+import pyRestTable
+import threading
+import time
+
+
+class PhaseRecord:
+    """
+    span-style timers for the phases of one acquisition cycle
+
+    Time spent in each named phase is accumulated (s).
+    Call ``save()`` once the cycle is complete.
+    """
+
+    def __init__(self, store, label=None):
+        self.store = store
+        self.label = label
+        self.time = time.time()
+        self.phases = {}
+
+    def add(self, phase, seconds):
+        """add time (s) to the phase"""
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        """context manager: time the enclosed code"""
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - t0)
+
+    def timed(self, phase, plan):
+        """plan: time the plan"""
+        t0 = time.time()
+        try:
+            return (yield from plan)
+        finally:
+            self.add(phase, time.time() - t0)
+
+    def save(self, **facts):
+        """append this record to the store"""
+        record = dict(time=self.time, label=self.label, phases=self.phases)
+        record.update(facts)
+        self.store.append(record)
+
+
+class PhaseTimingStore:
+    """
+    local time-series store of acquisition phase times
+
+    One JSON record per line: ``time``, ``label``, ``uid``,
+    and ``phases`` (dictionary of seconds by phase name).
+
+    PARAMETERS
+
+    path : str
+        name of the store file (directory created as needed)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def new_record(self, label=None):
+        """start timing a new acquisition cycle"""
+        return PhaseRecord(self, label=label)
+
+    def append(self, record):
+        """append one record (thread-safe)"""
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+        except OSError as exc:
+            logger.warning("could not save phase times: %s", exc)
+
+    def read(self, n=None):
+        """list of the last ``n`` records (all if ``None``)"""
+        if not os.path.exists(self.path):
+            return []
+        with self._lock, open(self.path) as f:
+            lines = f.readlines()
+        records = []
+        for line in lines[-n if n else 0:]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+        return records
+
+    def report(self, n=100, label=None):
+        """
+        table of percentiles per phase, across the last ``n`` records
+
+        Only records whose label starts with ``label`` are used, if given.
+        """
+        records = [
+            r for r in self.read(n)
+            if label is None or str(r.get("label")).startswith(label)
+        ]
+        phases = {}
+        for r in records:
+            for k, v in r["phases"].items():
+                phases.setdefault(k, []).append(v)
+
+        tbl = pyRestTable.Table()
+        tbl.labels = "phase n mean p50 p90 p99 max".split()
+        for k, v in phases.items():
+            v = np.array(v)
+            p50, p90, p99 = np.percentile(v, [50, 90, 99])
+            tbl.addRow(
+                [k, len(v)]
+                + [f"{x:.4f}" for x in (v.mean(), p50, p90, p99, v.max())]
+            )
+        print(f"phase times (s) of {len(records)} acquisitions from {self.path}")
+        print(tbl)
+        return tbl
+
+
+acquisition_timing = PhaseTimingStore(
+    os.path.join(
+        os.environ.get("HOME", os.getcwd()),
+        ".config",
+        "Bluesky_timing",
+        "acquisition_phases.jsonl",
+    )
+)
+
+
+def acquisition_timing_report(n=100, label=None):
+    """print percentiles per acquisition phase across recent runs"""
+    return acquisition_timing.report(n=n, label=label)
@@ -98,7 +98,7 @@ class MyPV(object):
             response = self.pv.put(value)
 
         else:
-            logger.debug(f'caput("{self.pv.pvname}", {value})')
+            logger.debug('caput("%s", %s)', self.pv.pvname, value)
             try:
                 response = self.pv.put(value, wait=wait, timeout=timeout)
             except Exception as exc:
@@ -115,9 +115,10 @@ class MyPV(object):
                     ):
                 time.sleep(0.0002)
         
-            msg = (f'value now: {self.pv.get(as_string=self.string)}'
-                   f"   in {time.time()-t0:.4f}s")
-            logger.debug(msg)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    'value now: %s   in %.4fs',
+                    self.pv.get(as_string=self.string), time.time()-t0)
         return response
 
 
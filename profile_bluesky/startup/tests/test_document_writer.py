@@ -0,0 +1,150 @@
+"""
+tests of the buffered document writer, with a stand-in catalog
+
+run from the ``startup`` directory::
+
+    python -m unittest discover -s tests
+"""
+
+import event_model
+import importlib.util
+import json
+import logging
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+STARTUP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_document_writer():
+    """
+    import framework/document_writer.py without the session
+
+    The ``instrument`` package starts the IPython session and connects
+    to the database on import.  Use placeholder packages (and a plain
+    logger) so that only this module is imported.
+    """
+    for name in ("instrument", "instrument.framework"):
+        if name not in sys.modules:
+            package = types.ModuleType(name)
+            package.__path__ = []
+            sys.modules[name] = package
+    if "instrument.session_logs" not in sys.modules:
+        session_logs = types.ModuleType("instrument.session_logs")
+        session_logs.logger = logging.getLogger("test")
+        sys.modules["instrument.session_logs"] = session_logs
+    path = os.path.join(STARTUP, "instrument", "framework", "document_writer.py")
+    spec = importlib.util.spec_from_file_location(
+        "instrument.framework.document_writer", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+document_writer = load_document_writer()
+
+
+class StandInCatalog:
+    """records inserted documents, fails after ``fail_after`` inserts"""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.inserted = []
+
+    def insert(self, name, doc):
+        if self.fail_after is not None and len(self.inserted) >= self.fail_after:
+            raise ConnectionError("database not available")
+        self.inserted.append((name, doc))
+
+
+def make_run(num_events=5, num_datums=3):
+    """list of (name, doc) of one run: datums and events"""
+    run = event_model.compose_run()
+    documents = [("start", run.start_doc)]
+    resource = run.compose_resource(
+        spec="IMM", root="/", resource_path="data.imm", resource_kwargs={})
+    documents.append(("resource", resource.resource_doc))
+    for i in range(num_datums):
+        documents.append(("datum", resource.compose_datum(datum_kwargs={"index": i})))
+    stream = run.compose_descriptor(
+        name="primary",
+        data_keys={"det": dict(source="sim", dtype="number", shape=[])},
+    )
+    documents.append(("descriptor", stream.descriptor_doc))
+    for i in range(num_events):
+        documents.append(("event", stream.compose_event(
+            data={"det": float(i)}, timestamps={"det": 0.0}, seq_num=i + 1)))
+    documents.append(("stop", run.compose_stop()))
+    return documents
+
+
+def read_lines(fname):
+    with open(fname) as fp:
+        return [json.loads(line) for line in fp]
+
+
+class TestBufferedDocumentWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.spill_path = tempfile.mkdtemp()
+
+    def write(self, catalog, documents, **kwargs):
+        writer = document_writer.BufferedDocumentWriter(
+            catalog.insert, self.spill_path, flush_interval=0.05, **kwargs)
+        for name, doc in documents:
+            writer(name, doc)
+        self.assertTrue(writer.flush(timeout=5))
+        return writer
+
+    def test_pages_are_packed(self):
+        catalog = StandInCatalog()
+        self.write(catalog, make_run(num_events=5, num_datums=3))
+        names = [name for name, _ in catalog.inserted]
+        self.assertEqual(
+            names,
+            ["start", "resource", "datum_page", "descriptor", "event_page", "stop"])
+        pages = dict(catalog.inserted)
+        self.assertEqual(len(pages["datum_page"]["datum_id"]), 3)
+        self.assertEqual(pages["event_page"]["data"]["det"], [0, 1, 2, 3, 4])
+
+    def test_no_packing(self):
+        catalog = StandInCatalog()
+        documents = make_run()
+        self.write(catalog, documents, pack_pages=False)
+        self.assertEqual(catalog.inserted, documents)
+
+    def test_flush_at_stop(self):
+        catalog = StandInCatalog()
+        writer = document_writer.BufferedDocumentWriter(
+            catalog.insert, self.spill_path, flush_interval=60)
+        for name, doc in make_run():
+            writer(name, doc)
+        # the stop document ends the batch: no waiting for flush_interval
+        self.assertTrue(writer.flush(timeout=5))
+        self.assertEqual(catalog.inserted[-1][0], "stop")
+        self.assertEqual(writer.pending, 0)
+
+    def test_spill_on_failure(self):
+        documents = make_run(num_events=5, num_datums=0)
+        catalog = StandInCatalog(fail_after=3)     # start, resource, descriptor
+        writer = self.write(catalog, documents, pack_pages=False)
+        self.assertEqual(len(writer.spill_files), 1)
+        uid = documents[0][1]["uid"]
+        self.assertEqual(
+            os.path.basename(writer.spill_files[0]), f"{uid}.jsonl")
+
+        spilled = read_lines(writer.spill_files[0])
+        # start (to identify the run), then only what was not inserted
+        self.assertEqual(spilled[0], ["start", documents[0][1]])
+        not_inserted = documents[3:]
+        self.assertEqual([n for n, _ in spilled[1:]], [n for n, _ in not_inserted])
+        self.assertEqual(
+            [d["uid"] for _, d in spilled[1:]],
+            [d["uid"] for _, d in not_inserted])
+
+
+if __name__ == "__main__":
+    unittest.main()